@@ -0,0 +1,128 @@
+'''
+Runs the network coincidence trigger of a tuned STA/LTA configuration over a
+ long period without the Bokeh page, and writes the triggers to a catalog.
+
+The datasource, channels and number of stations required come from the
+ configuration file, the STA/LTA parameters from the command line. The period
+ is cut into windows that are processed by a pool of worker processes; each
+ window is read with WARMUP lta lengths and the longest trigger of data before
+ it and the longest trigger after it, so the windows overlap and triggers
+ across their boundaries are found once (see stalta_tuner.batch). Finished windows go to a
+ checkpoint file next to the catalog: run the same command again to resume
+ after an interruption.
+
+USAGE
+$ python batch.py MSH_lite 2004-10-01 2004-11-01 --algorithm recstalta --sta 3 --lta 8 --thr-on 1.4 --thr-off 0.8
+$ python batch.py MSH_lite 2004-10-01 2004-11-01 --algorithm carlstatrig --sta 5 --lta 10 --thr-on 20 --thr-off -20 --option ratio=0.8 --option quiet=0.8 --processes 8
+'''
+
+import argparse
+import importlib
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from obspy import UTCDateTime
+
+from stalta_tuner.archive import DEFAULT_ROOT
+from stalta_tuner.batch import batch_windows, detect_window, write_catalog, Checkpoint
+
+FREQMIN = 0.5 # same bandpass as main.py
+FREQMAX = 3
+WINDOW = 3600 # seconds of data per job
+WARMUP = 3 # lta lengths read before each window, for the filter and the CFT to settle, besides MAX_TRIGGER
+MAX_TRIGGER = 60 # seconds; longer single station triggers are released, and this much is read after each window and
+                 # before it, as a channel may trigger on the unsettled CFT at the start of the data and stay on that long
+NFETCH = 8 # channels requested from a waveserver at the same time, per worker process
+FETCH_TIMEOUT = 60 # seconds per request before a channel is given up as empty
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Headless STA/LTA coincidence trigger over a long period')
+    parser.add_argument('config', help='configuration file in configs/, e.g. MSH_lite')
+    parser.add_argument('start', help='start of the period, e.g. 2004-10-01')
+    parser.add_argument('end', help='end of the period')
+    parser.add_argument('--algorithm', default='classicstalta', help='obspy trigger type, e.g. recstalta (default: classicstalta)')
+    parser.add_argument('--sta', type=float, required=True, help='STA window (seconds)')
+    parser.add_argument('--lta', type=float, required=True, help='LTA window (seconds)')
+    parser.add_argument('--thr-on', type=float, required=True, help='trigger on threshold')
+    parser.add_argument('--thr-off', type=float, required=True, help='trigger off threshold')
+    parser.add_argument('--option', action='append', default=[], metavar='KEY=VALUE', help='algorithm specific option, e.g. ratio=0.8')
+    parser.add_argument('--freqmin', type=float, default=FREQMIN)
+    parser.add_argument('--freqmax', type=float, default=FREQMAX)
+    parser.add_argument('--window', type=float, default=WINDOW, help='seconds of data per job (default: %(default)s)')
+    parser.add_argument('--max-trigger', type=float, default=MAX_TRIGGER, help='longest single station trigger in seconds (default: %(default)s)')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='worker processes (default: number of cores)')
+    parser.add_argument('--catalog', help='CSV file of the triggers (default: <config>_<start>_<end>.csv)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = importlib.import_module('configs.' + args.config)
+    tstart, tend = UTCDateTime(args.start), UTCDateTime(args.end)
+    options = {}
+    for option in args.option:
+        key, value = option.split('=')
+        options[key] = float(value)
+    catalog = args.catalog or '{}_{}_{}.csv'.format(args.config, tstart.strftime('%Y%m%dT%H%M%S'), tend.strftime('%Y%m%dT%H%M%S'))
+
+    # everything that changes the triggers; resuming with other values is refused
+    params = dict(config=args.config, datasource=config.datasource, scnl=config.scnl, ntriggersta=config.ntriggersta,
+                  start=str(tstart), end=str(tend), window=args.window, algorithm=args.algorithm,
+                  sta=args.sta, lta=args.lta, thr_on=args.thr_on, thr_off=args.thr_off, options=options,
+                  freqmin=args.freqmin, freqmax=args.freqmax, max_trigger=args.max_trigger)
+    try:
+        checkpoint = Checkpoint(catalog + '.checkpoint', params)
+    except ValueError as e:
+        print('{}: remove it to start over, or use another --catalog'.format(e))
+        return 2
+    windows = batch_windows(tstart, tend, args.window)
+    nwindows = len(windows)
+    windows = [(t1, t2) for t1, t2 in windows if t1 not in checkpoint]
+    print('{} windows of {} s, {} done before, {} to go, {} processes'.format(
+        nwindows, args.window, nwindows - len(windows), len(windows), args.processes))
+
+    spec = [('filter', dict(type='bandpass', freqmin=args.freqmin, freqmax=args.freqmax))]
+    fetch_options = dict(n_workers=NFETCH, timeout=FETCH_TIMEOUT,
+                         archive=getattr(config, 'archive', DEFAULT_ROOT)) # as main.py
+    seconds = 0. # of data processed by this run, per channel
+    ntraces = 0
+    failed = 0
+    t = time.time()
+    with ProcessPoolExecutor(max_workers=args.processes) as pool:
+        futures = {pool.submit(detect_window, config.datasource, config.scnl, t1, t2,
+                               args.algorithm, args.thr_on, args.thr_off, config.ntriggersta,
+                               before=WARMUP*args.lta + args.max_trigger, after=args.max_trigger, spec=spec,
+                               fetch_options=fetch_options, sta=args.sta, lta=args.lta,
+                               max_trigger_length=args.max_trigger, **options): (t1, t2)
+                   for t1, t2 in windows}
+        for future in as_completed(futures):
+            t1, t2 = futures[future]
+            try:
+                rows, n = future.result()
+            except Exception as e:
+                failed += 1
+                print('{} failed: {}'.format(t1, e))
+                continue
+            checkpoint.add(t1, rows, n)
+            seconds += t2 - t1
+            ntraces += n * (t2 - t1)
+            print('{} done: {} triggers ({}/{} windows)'.format(t1, len(rows), len(checkpoint.done), nwindows))
+    wall = time.time() - t
+
+    triggers = checkpoint.triggers()
+    write_catalog(catalog, triggers)
+    print('')
+    print('{} triggers written to {}'.format(len(triggers), catalog))
+    print('{:.1f} hours of data ({:.1f} channel hours) in {:.1f} s: {:.2f} hours of data per wall-second ({:.2f} channel hours)'.format(
+        seconds/3600, ntraces/3600, wall, seconds/3600/wall if wall else 0, ntraces/3600/wall if wall else 0))
+    if failed:
+        print('{} windows failed; run the same command again to retry them'.format(failed))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,99 @@
+'''
+Compares the sweep-line coincidence engine (stalta_tuner.trigger.coincidence_events)
+ with the list based version it replaced (coincidence_events_py).
+
+Builds random single station triggers for a synthetic network, with common
+ events seen on many stations plus independent noise triggers, checks that both
+ versions return the same events and prints their run times.
+
+USAGE
+$ python -m benchmarks.coincidence [nchannels] [hours]
+'''
+
+import sys
+import time
+
+import numpy as np
+
+from obspy import Trace, UTCDateTime
+
+from stalta_tuner.trigger import (coincidence_events, coincidence_events_py,
+                                  trigger_array)
+
+
+def synthetic_triggers(nchannels, hours, sampling_rate=100., seed=42):
+    '''Returns traces holding random CFTs and their trigger on/off samples'''
+    rng = np.random.default_rng(seed)
+    npts = int(hours * 3600 * sampling_rate)
+    events = rng.integers(0, npts, size=int(hours * 20)) # 20 network events per hour
+    traces = []; onsets = []
+    for n in range(nchannels):
+        tr = Trace(data=rng.random(1000)) # CFT peaks are taken from these 1000 values
+        tr.stats.network = 'XX'
+        tr.stats.station = 'S{:03d}'.format(n)
+        tr.stats.channel = 'EHZ'
+        tr.stats.sampling_rate = sampling_rate
+        tr.stats.starttime = UTCDateTime(2004, 9, 28)
+        seen = events[rng.random(len(events)) < 0.6] + rng.integers(0, 500, size=1)
+        noise = rng.integers(0, npts, size=int(hours * 30)) # 30 noise triggers per hour
+        on = np.unique(np.concatenate((seen, noise)))
+        off = on + rng.integers(50, 1500, size=len(on))
+        onsets.append(np.column_stack((on, off)))
+        traces.append(tr)
+    return traces, onsets
+
+
+def old_triggers(traces, onsets):
+    '''Single station triggers as built by the previous coincidence_trigger'''
+    triggers = []
+    for tr, tmp_triggers in zip(traces, onsets):
+        for on, off in tmp_triggers:
+            cft_peak = tr.data[on % 1000]
+            on = tr.stats.starttime + float(on) / tr.stats.sampling_rate
+            off = tr.stats.starttime + float(off) / tr.stats.sampling_rate
+            triggers.append((on.timestamp, off.timestamp, tr.id, cft_peak, 0))
+    return triggers
+
+
+def new_triggers(traces, onsets):
+    triggers = []
+    for n, (tr, tmp_triggers) in enumerate(zip(traces, onsets)):
+        triggers.append(trigger_array(tmp_triggers, tr, n))
+        triggers[-1]['cft_peak'] = tr.data[tmp_triggers[:, 0] % 1000]
+    return np.concatenate(triggers)
+
+
+def same_events(old, new):
+    if len(old) != len(new):
+        return False
+    for a, b in zip(old, new):
+        if (a['time'] != b['time'] or a['trace_ids'] != b['trace_ids'] or
+                a['stations'] != b['stations'] or
+                a['coincidence_sum'] != b['coincidence_sum'] or
+                abs(a['duration'] - b['duration']) > 1e-6 or
+                not np.allclose(a.get('cft_peaks', []), b.get('cft_peaks', []))):
+            return False
+    return True
+
+
+if __name__ == '__main__':
+    nchannels = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    hours = float(sys.argv[2]) if len(sys.argv) > 2 else 24
+    traces, onsets = synthetic_triggers(nchannels, hours)
+    rng = np.random.default_rng(0)
+    trace_ids = dict((tr.id, float(rng.integers(1, 3))) for tr in traces)
+    print('{} channels, {} h, {} single station triggers'.format(
+        nchannels, hours, sum(len(o) for o in onsets)))
+
+    for thr_coincidence_sum, extension, details in [(nchannels // 4, 0, False), (nchannels // 2, 5, True)]:
+        kwargs = dict(trigger_off_extension=extension, details=details)
+        t = time.time()
+        old = coincidence_events_py(old_triggers(traces, onsets), trace_ids, thr_coincidence_sum, **kwargs)
+        t_old = time.time() - t
+        t = time.time()
+        new = coincidence_events(new_triggers(traces, onsets), trace_ids, thr_coincidence_sum, **kwargs)
+        t_new = time.time() - t
+        print('thr_coincidence_sum={} trigger_off_extension={} details={}: {} events, identical: {}, '
+              'old {:.2f} s, new {:.2f} s ({:.0f}x)'.format(
+                  thr_coincidence_sum, extension, details, len(new), same_events(old, new),
+                  t_old, t_new, t_old / t_new))
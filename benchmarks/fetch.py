@@ -0,0 +1,95 @@
+'''
+Times the server branch of stalta_tuner.utils.get_stream one channel after the
+ other and with n_workers, against a local stand-in for a waveserver that answers
+ every request after a fixed latency, and checks that both return the same stream.
+
+The stand-in answers like an Earthworm waveserver (get_waveforms only) or, with
+ --fdsn, like an FDSN server (get_waveforms_bulk too). Channels named NODATA get
+ an empty stream and channels named TIMEOUT raise socket.timeout.
+
+USAGE
+$ python -m benchmarks.fetch [nchannels] [latency] [n_workers] [--fdsn]
+'''
+
+import socket
+import sys
+import threading
+import time
+
+import numpy as np
+
+from obspy import Stream, Trace, UTCDateTime
+
+from stalta_tuner.utils import get_stream
+
+
+class StandInWaveserver(object):
+    '''Answers waveform requests with synthetic noise after latency seconds'''
+
+    def __init__(self, latency=0.2, sampling_rate=100.):
+        self.latency = latency
+        self.sampling_rate = sampling_rate
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def _trace(self, network, station, location, channel, starttime, endtime):
+        seed = sum(map(ord, network + station + location + channel))
+        npts = int((endtime - starttime) * self.sampling_rate) + 1
+        tr = Trace(data=np.random.default_rng(seed).integers(-1000, 1000, npts).astype(np.int32))
+        tr.stats.network = network
+        tr.stats.station = station
+        tr.stats.location = location.replace('--', '')
+        tr.stats.channel = channel
+        tr.stats.sampling_rate = self.sampling_rate
+        tr.stats.starttime = starttime
+        return tr
+
+    def _answer(self, bulk):
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.latency)
+            st = Stream()
+            for network, station, location, channel, starttime, endtime in bulk:
+                if station == 'TIMEOUT' and len(bulk) == 1:
+                    raise socket.timeout('timed out')
+                if station not in ('NODATA', 'TIMEOUT'):
+                    st.append(self._trace(network, station, location, channel, starttime, endtime))
+            return st
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def get_waveforms(self, network, station, location, channel, starttime, endtime):
+        return self._answer([(network, station, location, channel, starttime, endtime)])
+
+
+class StandInFDSN(StandInWaveserver):
+    def get_waveforms_bulk(self, bulk):
+        return self._answer(bulk)
+
+
+if __name__ == '__main__':
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    nchannels = int(args[0]) if len(args) > 0 else 20
+    latency = float(args[1]) if len(args) > 1 else 0.2
+    n_workers = int(args[2]) if len(args) > 2 else 8
+    server = StandInFDSN if '--fdsn' in sys.argv else StandInWaveserver
+    scnl = ['S{:03d}.EHZ.XX.--'.format(n) for n in range(nchannels - 2)] + ['NODATA.EHZ.XX.--', 'TIMEOUT.EHZ.XX.--']
+    t1 = UTCDateTime(2004, 9, 28); t2 = t1 + 30*60
+
+    results = []
+    for workers in [None, n_workers]:
+        client = server(latency)
+        t = time.time()
+        st = get_stream('standin', scnl, t1, t2, client=client, n_workers=workers)
+        results.append(st)
+        print('{} n_workers={}: {:.2f} s, {} requests, at most {} at once'.format(
+            server.__name__, workers, time.time() - t, client.requests, client.max_in_flight))
+    same = [tr.id for tr in results[0]] == [tr.id for tr in results[1]] and \
+        all(np.array_equal(a.data, b.data) for a, b in zip(*results))
+    print('{} traces, identical: {}'.format(len(results[1]), same))
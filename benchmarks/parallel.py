@@ -0,0 +1,54 @@
+'''
+Times coincidence_trigger with characteristic functions computed serially and
+ on a thread pool (n_workers), on a synthetic network of noise traces, and checks
+ that both return the same triggers.
+
+USAGE
+$ python -m benchmarks.parallel [nchannels] [minutes] [n_workers]
+'''
+
+import os
+import sys
+import time
+
+import numpy as np
+
+from obspy import Stream, Trace, UTCDateTime
+
+from stalta_tuner.trigger import coincidence_trigger
+
+
+def synthetic_stream(nchannels, minutes, sampling_rate=100., seed=42):
+    rng = np.random.default_rng(seed)
+    npts = int(minutes * 60 * sampling_rate)
+    st = Stream()
+    for n in range(nchannels):
+        tr = Trace(data=rng.standard_normal(npts))
+        tr.stats.network = 'XX'
+        tr.stats.station = 'S{:03d}'.format(n)
+        tr.stats.channel = 'EHZ'
+        tr.stats.sampling_rate = sampling_rate
+        tr.stats.starttime = UTCDateTime(2004, 9, 28)
+        st.append(tr)
+    return st
+
+
+if __name__ == '__main__':
+    nchannels = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    minutes = float(sys.argv[2]) if len(sys.argv) > 2 else 30
+    n_workers = int(sys.argv[3]) if len(sys.argv) > 3 else os.cpu_count()
+    st = synthetic_stream(nchannels, minutes)
+    print('{} channels, {} min, {} workers ({} cores)'.format(nchannels, minutes, n_workers, os.cpu_count()))
+
+    for trigger_type in ['classicstalta', 'recstalta', 'delayedstalta', 'carlstatrig']:
+        options = dict(ratio=0.8, quiet=0.8) if trigger_type == 'carlstatrig' else {}
+        thr_on, thr_off = (1.3, 1.0) if trigger_type != 'carlstatrig' else (0.2, -0.2)
+        t = time.time()
+        _, serial = coincidence_trigger(trigger_type, thr_on, thr_off, st, 3, sta=1, lta=10, **options)
+        t_serial = time.time() - t
+        t = time.time()
+        _, parallel = coincidence_trigger(trigger_type, thr_on, thr_off, st, 3, sta=1, lta=10,
+                                          n_workers=n_workers, **options)
+        t_parallel = time.time() - t
+        print('{}: {} triggers, identical: {}, serial {:.2f} s, parallel {:.2f} s ({:.1f}x)'.format(
+            trigger_type, len(serial), serial == parallel, t_serial, t_parallel, t_serial / t_parallel))
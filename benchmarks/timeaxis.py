@@ -0,0 +1,70 @@
+'''
+Compares the time axes sent to the CFT plots: one Python datetime per sample
+ from num2date (as main.py did) and float64 ms since epoch from
+ stalta_tuner.utils.times_ms.
+
+Builds synthetic 100 Hz CFTs, converts their times both ways, assigns them to
+ ColumnDataSources of a Bokeh document and encodes the resulting PATCH-DOC
+ message as the server would send it on an update. Prints the time of the
+ conversion and the encoding, and the size of the message.
+
+USAGE
+$ python -m benchmarks.timeaxis [nchannels] [minutes]
+'''
+
+import sys
+import time
+
+import numpy as np
+
+from bokeh.document import Document
+from bokeh.models import ColumnDataSource
+from bokeh.protocol import Protocol
+from matplotlib.dates import num2date
+
+from obspy import Trace, UTCDateTime
+
+from stalta_tuner.utils import times_ms
+
+
+def buffer_nbytes(buffer):
+    '''Size of a message buffer, a (header, payload) pair in older Bokeh'''
+    payload = buffer[1] if isinstance(buffer, tuple) else getattr(buffer, 'data', buffer)
+    return memoryview(payload).nbytes
+
+
+def update(sources, traces, times):
+    '''Seconds spent and bytes sent to update the sources with the traces'''
+    doc = Document()
+    for source in sources:
+        doc.add_root(source)
+    events = []
+    doc.on_change(lambda event: events.append(event))
+    t = time.time()
+    for source, tr in zip(sources, traces):
+        source.data = dict(times=times(tr), cft=tr.data)
+    msg = Protocol().create('PATCH-DOC', events)
+    nbytes = len(msg.header_json) + len(msg.metadata_json) + len(msg.content_json) + \
+        sum(buffer_nbytes(b) for b in msg.buffers)
+    return time.time() - t, nbytes
+
+
+if __name__ == '__main__':
+    nchannels = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    minutes = float(sys.argv[2]) if len(sys.argv) > 2 else 30
+    rng = np.random.default_rng(42)
+    traces = []
+    for n in range(nchannels):
+        tr = Trace(data=rng.random(int(minutes * 60 * 100) + 1) + 1)
+        tr.stats.sampling_rate = 100.
+        tr.stats.starttime = UTCDateTime(2004, 9, 28)
+        traces.append(tr)
+
+    for name, times in [('num2date', lambda tr: num2date(tr.times('matplotlib'))),
+                        ('times_ms', times_ms)]:
+        sources = [ColumnDataSource(data=dict(times=[], cft=[])) for tr in traces]
+        seconds, nbytes = update(sources, traces, times)
+        print('{}: {:.2f} s, {:.1f} MB per update'.format(name, seconds, nbytes / 1e6))
+    same = np.allclose([d.timestamp() * 1000. for d in num2date(traces[0].times('matplotlib'))[:1000]],
+                       times_ms(traces[0])[:1000], atol=1e-3)
+    print('same times: {}'.format(same))
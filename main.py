@@ -13,8 +13,15 @@ Use the ``bokeh serve`` command to run the example and open in a browser by exec
     bokeh serve . --show
 If the GUI does not open automatically, navigate to the URL
     http://localhost:5006/stalta_tuner
+Several server processes (bokeh serve --num-procs N) can share fetched windows
+ and CFTs through a disk cache, e.g.
+    STALTA_TUNER_DISK_CACHE=~/.stalta_tuner/cache bokeh serve . --num-procs 4
+ (see DISK_CACHE below).
 '''
 
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from os.path import dirname, join
 
 import pandas as pd
@@ -22,19 +29,25 @@ import numpy as np
 
 from bokeh.io import curdoc
 from bokeh.layouts import row, column, widgetbox
-from bokeh.models import ColumnDataSource, Span, BoxZoomTool, Div
-from bokeh.models.widgets import PreText, Select, RangeSlider, TextInput, Button
+from bokeh.models import ColumnDataSource, Span, BoxZoomTool, Div, LinearColorMapper
+from bokeh.models.widgets import PreText, Select, Slider, RangeSlider, TextInput, Button
+from bokeh.palettes import Viridis256
 from bokeh.plotting import figure
 
 from stalta_tuner import utils
 from stalta_tuner import plotting
+from stalta_tuner import sweep
+from stalta_tuner import decimate
+from stalta_tuner import archive
+from stalta_tuner.cache import SHARED_CACHE
+from stalta_tuner.diskcache import DiskCache
+from stalta_tuner.prefetch import Prefetcher
+from stalta_tuner.clients import CLIENT_POOL
 
 from obspy import UTCDateTime
 from obspy.signal.trigger import coincidence_trigger
 from obspy.core import Stream
 
-from matplotlib.dates import num2date
-
 import sys
 import importlib
 
@@ -50,6 +63,7 @@ settings['datasource'] = config.datasource
 settings['scnl'] = config.scnl
 settings['start'] = config.start
 settings['ntriggersta'] = config.ntriggersta
+settings['archive'] = getattr(config, 'archive', archive.DEFAULT_ROOT) # local copy of everything fetched, kept between sessions
 if '/' in config.datasource:
     print('File Structure currently not yet supported')
     sys.exit()
@@ -88,10 +102,19 @@ STALTA_ALGORITHMS = {
          'implemented':True},
    'Carl-Sta-Trig':
        {'name':'carlstatrig',
-        'implemented':False},
+        'default_stalta': [5, 10],
+        'default_trigonoff':[-20, 20],
+        'stalta_range':[0,15],
+        'trigonoff_range':[-100,100],
+        'options':{'ratio':0.8, 'quiet':0.8}, # extra keyword arguments and their defaults, set by option_sliders
+        'implemented':True},
    'Z-detect':
        {'name':'zdetect',
-       'implemented':False},
+        'default_stalta': [3, 10], # LTA is the trailing reference window for mean/std
+        'default_trigonoff':[1.0, 3.0],
+        'stalta_range':[0,15],
+        'trigonoff_range':[-2,10],
+        'implemented':True},
 }
 
 
@@ -100,21 +123,41 @@ STALTA_ALGORITHMS = {
 STALTA_SEC = [3, 8] # Recursive defaults
 FREQMIN = 0.5
 FREQMAX = 3
+NWORKERS = os.cpu_count() # threads computing the CFTs of different channels in parallel
+CACHE_MB = int(os.environ.get('STALTA_TUNER_CACHE_MB', 512)) # memory for waveforms and CFTs of recently viewed windows, shared by all sessions of the server process
+DISK_CACHE = os.path.expanduser(os.environ.get('STALTA_TUNER_DISK_CACHE', '')) # directory of waveforms and CFTs shared by all server processes; off if empty
+DISK_CACHE_MB = int(os.environ.get('STALTA_TUNER_DISK_CACHE_MB', 4096)) # size of the disk cache
+WINDOW = 30*60 # seconds of data displayed at once
+NPREFETCH = 2 # windows loaded in the background on either side of the displayed one
+NFETCH = 8 # channels requested from a waveserver at the same time (FDSN gets one bulk request)
+FETCH_TIMEOUT = 60 # seconds per request before a channel is given up as empty
+FETCH_OPTIONS = dict(n_workers=NFETCH, timeout=FETCH_TIMEOUT, archive=settings['archive']) # passed on to utils.get_stream
+PREPROCESS = [('filter', dict(type='bandpass', freqmin=FREQMIN, freqmax=FREQMAX))] # applied to every window
 
 # Timeseries plot variables
 TSPLOTW = 900
 TSPLOTH = 200
 TSTOOLS = 'pan,reset'
 
+# Parameter sweep heatmap variables
+SWEEPW = 400
+SWEEPH = 400
+
 ###########################################################
 
 
 ###########################################################
 #### LOAD DATA & INIT CFT
 
-t1 = UTCDateTime(settings['start'][0]); t2 = t1 + 30*60 # limit displayed time to 30'
-st = utils.get_stream(settings['datasource'], settings['scnl'], t1, t2)    
-st = st.filter('bandpass', freqmin=FREQMIN, freqmax=FREQMAX)
+waveform_cache = SHARED_CACHE # keyed by datasource, scnl, t1, t2, PREPROCESS; every session (browser tab) runs this script, but they all share one cache
+waveform_cache.resize(CACHE_MB*2**20)
+if DISK_CACHE and waveform_cache.disk is None: # first session of this process
+    waveform_cache.disk = DiskCache(DISK_CACHE, max_bytes=DISK_CACHE_MB*2**20)
+prefetcher = Prefetcher(waveform_cache, n_windows=NPREFETCH, max_in_flight=2) # fills waveform_cache in the background
+t1 = UTCDateTime(settings['start'][0]); t2 = t1 + WINDOW # limit displayed time to 30'
+st = prefetcher.get_stream(settings['datasource'], settings['scnl'], t1, t2, PREPROCESS, **FETCH_OPTIONS)
+data_window = str(t1) # part of the key of cached CFTs
+prefetcher.prefetch(settings['datasource'], settings['scnl'], t1, WINDOW, PREPROCESS, **FETCH_OPTIONS)
 
 ###########################################################
 
@@ -130,6 +173,10 @@ back_button        = Button(label="<", sizing_mode='stretch_height')
 ticker_alg         = Select(value= list(STALTA_ALGORITHMS.keys())[0] , options = list(STALTA_ALGORITHMS.keys()), sizing_mode='stretch_height')
 stalta_slider      = RangeSlider(start=1, end=15, value=(3,8), step=1, title="STA/LTA (seconds)")
 trigger_slider     = RangeSlider(start=0, end=4, value=(0.8, 1.4), step=0.1, title="Trigger On/Off")
+ratio_slider       = Slider(start=0, end=2, value=STALTA_ALGORITHMS['Carl-Sta-Trig']['options']['ratio'], step=0.05, title="Ratio (Carl-Sta-Trig)", disabled=True)
+quiet_slider       = Slider(start=0, end=2, value=STALTA_ALGORITHMS['Carl-Sta-Trig']['options']['quiet'], step=0.05, title="Quiet (Carl-Sta-Trig)", disabled=True)
+option_sliders     = {'ratio':ratio_slider, 'quiet':quiet_slider} # algorithm specific options
+sweep_button       = Button(label="Sweep STA/LTA", sizing_mode='stretch_height')
 status_msg         = Div(text="""<font color='blue'>STA/LTA Tuner: Status Message.</font>""", width=200, height=25)
 
 print(stalta_slider)
@@ -147,18 +194,28 @@ source_triggers = ColumnDataSource(data=dict(ontimes=[], y=[]))
 sourcelist_cft = []
 for s in st:
     sourcelist_cft.append( ColumnDataSource(data=dict( times=[], cft=[] )) )
+cft_shown = None # key of the CFTs in sourcelist_cft
 
 # Initialize data source for raw waveforms
-offset = len(st)*2-2 # offset is defined and incremented such that (e.g.) four channels will be plotted top to bottom at center values 6,4,2,0    
-times = []; traces = [];
+def waveform_data(st_plot, tstart=None, tend=None):
+    # Min/max decimated to the plot width, at full resolution between tstart and tend (x axis units, ms since epoch)
+    offset = len(st_plot)*2-2 # offset is defined and incremented such that (e.g.) four channels will be plotted top to bottom at center values 6,4,2,0    
+    times = []; traces = []
+    for s in st_plot:
+        t0 = s.stats.starttime.timestamp
+        i0 = 0 if tstart is None else int(np.floor((tstart/1000. - t0)*s.stats.sampling_rate))
+        i1 = None if tend is None else int(np.ceil((tend/1000. - t0)*s.stats.sampling_rate))+1
+        idx = decimate.view_indices(s.data, TSPLOTW, i0, i1)
+        times.append(utils.times_ms(s, idx))
+        scale = np.abs(s.data).max() or 1. # channels without data are all fill_value=0
+        traces.append(s.data[idx]/scale+offset)
+        offset -= 2
+    waveclr = ['black']*len(st_plot)
+    return {'times':times, 'traces':traces, 'color':waveclr}
+
 st_plot = st.copy()
 st_plot.filter('lowpass', freq=20.0)
-for s in st_plot:
-    times.append(num2date(s.times('matplotlib')))
-    traces.append(s.data/max(s.data)+offset)
-    offset -= 2
-waveclr = ['black']*len(st)
-source_waveforms = ColumnDataSource( {'times':times, 'traces':traces, 'color':waveclr} )
+source_waveforms = ColumnDataSource(waveform_data(st_plot))
     
 ###########################################################
 
@@ -167,7 +224,7 @@ source_waveforms = ColumnDataSource( {'times':times, 'traces':traces, 'color':wa
 #vvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvv#
 ### WAVE PLOTS FROM DATASOURCE
 waveplot = figure(plot_width=TSPLOTW, plot_height=TSPLOTH, tools=TSTOOLS, x_axis_type='datetime',
-    title='Channels listed in same order as STALTA plots below (empty channels not shown). Sampled to 20 Hz for speed.')
+    title='Channels listed in same order as STALTA plots below (empty channels not shown). Lowpassed at 20 Hz, zoom in for full resolution.')
 waveplot.multi_line('times', 'traces', color='color', source=source_waveforms)
 waveplot.circle('ontimes', 'y', source=source_triggers, size=10, color='red')
 waveplot.add_tools(BoxZoomTool(dimensions="width"))
@@ -197,6 +254,49 @@ for s in sourcelist_cft:
 ############################################################
 
 
+###########################################################
+### PARAMETER SWEEP HEATMAP
+# Coincidence triggers for every STA/LTA pair at the current trigger thresholds; click a cell to use it
+source_sweep = ColumnDataSource(data=dict(sta=[], lta=[], triggers=[], coincidences=[]))
+sweep_mapper = LinearColorMapper(palette=Viridis256, low=0, high=1)
+heatplot = figure(title='Coincidence triggers per STA/LTA (seconds)', plot_width=SWEEPW, plot_height=SWEEPH,
+    tools='tap,reset', tooltips=[('STA/LTA', '@sta/@lta'), ('Coincidence triggers', '@coincidences'), ('Station triggers', '@triggers')],
+    x_axis_label='LTA', y_axis_label='STA')
+heatplot.rect('lta', 'sta', width=1, height=1, source=source_sweep, line_color=None,
+    fill_color={'field':'coincidences', 'transform':sweep_mapper})
+############################################################
+
+
+###########################################################
+### BACKGROUND JOBS
+# Callbacks only read the widgets and hand the computation to a thread, so the event loop stays free;
+# results are applied to the document on its next tick, and only if no newer job of the same kind was submitted
+doc = curdoc()
+executor = ThreadPoolExecutor(max_workers=1) # jobs run one at a time, in the order submitted
+jobs = {} # kind of job -> latest future
+
+def submit_job(kind, apply, fn, *args):
+    if kind in jobs:
+        jobs[kind].cancel() # superseded; only stops it if it has not started yet
+    future = executor.submit(fn, *args)
+    jobs[kind] = future
+    future.add_done_callback(lambda future: future.cancelled() or doc.add_next_tick_callback(partial(apply_job, kind, future, apply)))
+
+def apply_job(kind, future, apply):
+    if jobs.get(kind) is not future:
+        return # a newer job of this kind was submitted meanwhile
+    del jobs[kind]
+    apply(future.result())
+
+def session_destroyed(session_context):
+    # both pools belong to this session; their threads would outlive it otherwise
+    executor.shutdown(wait=False)
+    prefetcher.shutdown()
+
+doc.on_session_destroyed(session_destroyed)
+############################################################
+
+
 ###########################################################
 ### SET UP CALLBACKS
 
@@ -216,6 +316,8 @@ def ticker_alg_change(attrname, old, new):
     ### STALTA_ALGORITHMS[ticker_alg.value] is the same as 'new'
     trigger_slider.start = STALTA_ALGORITHMS[ticker_alg.value]['trigonoff_range'][0]
     trigger_slider.end = STALTA_ALGORITHMS[ticker_alg.value]['trigonoff_range'][1]
+    for key, slider in option_sliders.items():
+        slider.disabled = key not in STALTA_ALGORITHMS[ticker_alg.value].get('options', {})
     update_cft(old)
     
 def trigger_slider_change(attrname, old, new):
@@ -223,27 +325,73 @@ def trigger_slider_change(attrname, old, new):
     
 def stalta_slider_change(attrname, old, new):
     update_cft(old)
+
+def option_slider_change(attrname, old, new):
+    update_cft(ticker_alg.value)
+
+def sweep_button_click():
+    print('Sweep STA/LTA windows')
+    algorithm = STALTA_ALGORITHMS[ticker_alg.value]
+    if not algorithm['implemented']:
+        print(ticker_alg.value + ' is not yet implemented.')
+        return
+    windows = np.arange(stalta_slider.start, stalta_slider.end+1, stalta_slider.step)
+    options = {key:option_sliders[key].value for key in algorithm.get('options', {})}
+    thresholds = [(trigger_slider.value[1], trigger_slider.value[0])] # one threshold pair: the current on/off values
+    submit_job('sweep', show_sweep, compute_sweep, st, windows, thresholds, algorithm['name'], options)
+
+def compute_sweep(st, windows, thresholds, name, options):
+    ntriggers, ncoincidences = sweep.sta_lta_sweep(
+                    st, windows, windows, thresholds,
+                    settings['ntriggersta'], trigger_type=name, **options)
+    return windows, ntriggers, ncoincidences
+
+def show_sweep(result):
+    windows, ntriggers, ncoincidences = result
+    i, j = np.nonzero(ncoincidences[:, :, 0] >= 0) # skip invalid pairs (sta >= lta)
+    source_sweep.data = dict(sta=windows[i], lta=windows[j], triggers=ntriggers[i, j, 0], coincidences=ncoincidences[i, j, 0])
+    sweep_mapper.high = max(ncoincidences.max(), 1)
+
+def waveplot_range_change(attrname, old, new):
+    # Zooming or panning re-decimates the waveforms for the visible span only
+    if waveplot.x_range.start is None or waveplot.x_range.end is None:
+        return
+    submit_job('view', show_waveforms, waveform_data, st_plot, waveplot.x_range.start, waveplot.x_range.end)
+
+def show_waveforms(data):
+    source_waveforms.data = data
+
+def sweep_tap(attrname, old, new):
+    if len(new) == 0:
+        return
+    stalta_slider.value = (float(source_sweep.data['sta'][new[0]]), float(source_sweep.data['lta'][new[0]]))
+    update_cft(ticker_alg.value) # setting value from here does not change value_throttled
         
 def update_waveform():
+    t1 = UTCDateTime(start_input.value)
+    submit_job('waveform', show_window, load_window, t1)
 
-    # Load new data
-    global st
-    st = Stream()
+def load_window(t1):
 
-    st = utils.get_stream(settings['datasource'], settings['scnl'], UTCDateTime(start_input.value), UTCDateTime(start_input.value)+30*60)
-    st = st.filter('bandpass', freqmin=FREQMIN, freqmax=FREQMAX)
+    # Load new data
+    prefetcher.cancel() # the user moved on; drop queued windows around the previous position
+    st = prefetcher.get_stream(settings['datasource'], settings['scnl'], t1, t1+WINDOW, PREPROCESS, **FETCH_OPTIONS)
+    prefetcher.prefetch(settings['datasource'], settings['scnl'], t1, WINDOW, PREPROCESS, **FETCH_OPTIONS) # next and previous windows
+    print('Waveform cache: {hits} hits, {misses} misses, {evictions} evictions, {waits} waits, {nbytes} of {max_bytes} bytes'.format(**waveform_cache.stats()))
+    if waveform_cache.disk is not None:
+        print('Disk cache: {hits} hits, {misses} misses, {writes} writes, {evictions} evictions, {nbytes} of {max_bytes} bytes'.format(**waveform_cache.disk.stats()))
+    print('Client pool: {created} created, {reused} reused, {saved_per_fetch:.2f} s connection setup saved per fetch'.format(**CLIENT_POOL.stats()))
 
     # Initialize data source for filtered waveform plotting
     st_plot = st.copy()
     st_plot.filter('lowpass', freq=20.0)
-    offset = len(st)*2-2 # offset is defined and incremented such that (e.g.) four channels will be plotted top to bottom at center values 6,4,2,0    
-    times = []; traces = []
-    for s in st_plot:
-        times.append(num2date(s.times('matplotlib')))
-        traces.append(s.data/max(s.data)+offset)
-        offset -= 2
-    waveclr = ['black']*len(st)
-    source_waveforms.data = {'times':times, 'traces':traces, 'color':waveclr}
+    return str(t1), st, st_plot, waveform_data(st_plot)
+
+def show_window(result):
+    global data_window, st, st_plot
+    data_window, st, st_plot, data = result
+    jobs.pop('view', None) # drop views of the previous window
+    source_waveforms.data = data
     
     # Update the CFT
     update_cft(ticker_alg.value)
@@ -251,46 +399,87 @@ def update_waveform():
 def update_cft(prev_val, selected=None):
     print('{} ({})'.format(ticker_alg.value, STALTA_ALGORITHMS[ticker_alg.value]['name'])) # print algorithm used
     if STALTA_ALGORITHMS[ticker_alg.value]['implemented']:
-        
-        print('')
-        print(st)
-        print('')
-        
-        from stalta_tuner.trigger import coincidence_trigger
-        cft, triggers = coincidence_trigger(
-                    STALTA_ALGORITHMS[ticker_alg.value]['name'], # Converts human-readable algorithm name to obspy algorithm type
-                    trigger_slider.value[1], trigger_slider.value[0],   # threshold for on/off value of the cft
-                    st, # stream object # stream for computing data
-                    settings['ntriggersta'], # thr_coincidence_sum : number of stations required to have detection
-                    sta=stalta_slider.value[0], lta=stalta_slider.value[1] # sta/lta windows
-                                                   )
-        print('{} Stations required: {} triggers'.format(settings['ntriggersta'], len(triggers))) # print results
-        print('')
-
-        i=0
-        for p in cft_plots:
-            sourcelist_cft[i].data = dict(times=num2date(cft[i].times('matplotlib')), cft=cft[i].data)
-            trig_on_thresh[i].location = trigger_slider.value[1]
-            trig_off_thresh[i].location = trigger_slider.value[0]
-            i+=1
-        #cft_plots = plotting.cft_multiplot(sourcelist_cft, cft_thresh=[stalta_slider.value[0], stalta_slider.value[1]] )
-        
-        triggert = utils.trigtimes(triggers)
-        source_triggers.data = dict(ontimes=triggert, y=np.zeros(triggert.shape))
-        
+        params = dict(st=st, data_window=data_window, name=STALTA_ALGORITHMS[ticker_alg.value]['name'],
+                      thr_on=trigger_slider.value[1], thr_off=trigger_slider.value[0],
+                      sta=stalta_slider.value[0], lta=stalta_slider.value[1],
+                      options={key:option_sliders[key].value for key in STALTA_ALGORITHMS[ticker_alg.value].get('options', {})})
+        submit_job('cft', show_cft, compute_cft, params)
+    else:
+        print(ticker_alg.value + ' is not yet implemented.')
+        ticker_alg.value = prev_val
+
+def compute_cft(params):
+    st = params['st']
+    print('')
+    print(st)
+    print('')
+    
+    from stalta_tuner.trigger import coincidence_trigger
+    options = params['options']
+    # CFTs are cached with the waveforms, as one more processing step of the window
+    cft_spec = PREPROCESS + [('cft', dict(type=params['name'], sta=params['sta'], lta=params['lta'], **options))]
+    key = waveform_cache.key(settings['datasource'], settings['scnl'], params['data_window'], UTCDateTime(params['data_window'])+WINDOW, cft_spec)
+    computed = {}
+    def load():
+        cft, computed['triggers'] = coincidence_trigger(
+                params['name'], # obspy algorithm type
+                params['thr_on'], params['thr_off'],   # threshold for on/off value of the cft
+                st, # stream object # stream for computing data
+                settings['ntriggersta'], # thr_coincidence_sum : number of stations required to have detection
+                sta=params['sta'], lta=params['lta'], # sta/lta windows
+                n_workers=NWORKERS,
+                copy=False, # read st without copying, CFTs go into one new 2-D buffer
+                **options # algorithm specific options (e.g., ratio, quiet)
+                                               )
+        for c in cft:
+            c.data.flags.writeable = False # shared with other sessions
+        return cft
+    cft = waveform_cache.get_or_load(key, load, copy=False) # computed once, however many sessions ask at the same time
+    triggers = computed.get('triggers')
+    if triggers is None:
+        # The CFTs were cached (only the thresholds changed, or another session computed them): trigger on them
+        _, triggers = coincidence_trigger(
+                None, # cft holds characteristic functions already
+                params['thr_on'], params['thr_off'],
+                cft, settings['ntriggersta'],
+                n_workers=NWORKERS, copy=False,
+                gap_holdoff=params['lta'] # as computed from the lta when the CFTs were made
+                                         )
+    print('{} Stations required: {} triggers'.format(settings['ntriggersta'], len(triggers))) # print results
+    print('')
+    return key, cft, utils.trigtimes(triggers), params
+
+def show_cft(result):
+    global cft_shown
+    key, cft, triggert, params = result
+
+    # Send the CFTs only if they are not the ones shown already
+    if key != cft_shown:
+        for i in range(len(cft_plots)):
+            sourcelist_cft[i].data = dict(times=utils.times_ms(cft[i]), cft=cft[i].data)
+        cft_shown = key
+
         # Change setting for minimum and maximum Trigger On/Off
         cft_min = []
         cft_max = []
         for c in cft:
             c = c.data[100:] # eliminate the first 100 samples bc those are goofy
-            cft_min.append( (min(c)//1) + min(c)%1*10//1/10-.1 ) # weird way to do rounding (probably an easier way)
-            cft_max.append( (max(c)//1) + max(c)%1*10//1/10+.1 ) # weird way to do rounding (probably an easier way)
+            cft_min.append( (c.min()//1) + c.min()%1*10//1/10-.1 ) # weird way to do rounding (probably an easier way)
+            cft_max.append( (c.max()//1) + c.max()%1*10//1/10+.1 ) # weird way to do rounding (probably an easier way)
             #print( (max(c.data)//1) + max(c.data)%1*10//1/10+.1 )
         print('new CFT min/max: {},{}'.format(min(cft_min), max(cft_max)))
-            
+    for i in range(len(cft_plots)):
+        trig_on_thresh[i].location = params['thr_on'] # sends only this property, and only if it changed
+        trig_off_thresh[i].location = params['thr_off']
+    #cft_plots = plotting.cft_multiplot(sourcelist_cft, cft_thresh=[stalta_slider.value[0], stalta_slider.value[1]] )
+    
+    if len(triggert) == len(source_triggers.data['ontimes']):
+        # Same number of triggers: patch the times that moved instead of resending the source
+        moved = np.flatnonzero(triggert != np.asarray(source_triggers.data['ontimes']))
+        if len(moved):
+            source_triggers.patch({'ontimes': [(int(k), triggert[k]) for k in moved]})
     else:
-        print(ticker_alg.value + ' is not yet implemented.')
-        ticker_alg.value = prev_val
+        source_triggers.data = dict(ontimes=triggert, y=np.zeros(triggert.shape))
 
 
 ###########################################################
@@ -298,17 +487,25 @@ def update_cft(prev_val, selected=None):
 
 start_input.on_change('value', start_input_change)        
 ticker_alg.on_change('value', ticker_alg_change)
-trigger_slider.on_change('value', trigger_slider_change)
-stalta_slider.on_change('value', stalta_slider_change)
+trigger_slider.on_change('value_throttled', trigger_slider_change) # once the slider is released, not for every value dragged over
+stalta_slider.on_change('value_throttled', stalta_slider_change)
+ratio_slider.on_change('value_throttled', option_slider_change)
+quiet_slider.on_change('value_throttled', option_slider_change)
 forward_button.on_click(forward_button_click)
 back_button.on_click(back_button_click)
+sweep_button.on_click(sweep_button_click)
+source_sweep.selected.on_change('indices', sweep_tap)
+waveplot.x_range.on_change('start', waveplot_range_change) # shared by the cft plots
+waveplot.x_range.on_change('end', waveplot_range_change)
 
 # set up layout
 data_header = row(datasource_input, nslc_input, widgetbox(load_data_button, width=40)  ) 
 timing_header = row( widgetbox(back_button, width=40), widgetbox(start_input, width=175), widgetbox(forward_button, width=40) ) 
 stalta_header = row(ticker_alg, stalta_slider, trigger_slider)
+option_header = row(ratio_slider, quiet_slider)
 seisplots = column(waveplot, column(cft_plots))
-layout = column(data_header, timing_header, stalta_header, status_msg, seisplots)
+sweep_panel = column(widgetbox(sweep_button, width=150), heatplot)
+layout = column(data_header, timing_header, stalta_header, option_header, status_msg, row(seisplots, sweep_panel))
 
 # initialize
 update_cft('Classic STA/LTA')
@@ -0,0 +1,245 @@
+"""
+Local archive of channel-days for repeated tuning sessions.
+Every channel and UTC day is kept at one fixed sampling rate as three files:
+``.data.npy`` holds the samples (int32 for raw counts, float32 otherwise),
+``.state.npy`` marks every sample as not fetched yet, data or gap, and
+``.json`` is a small header with SEED id, sampling rate, start time, dtype
+and length. Both arrays are read through :class:`numpy.memmap`, so a window
+read back is a slice of the memory-mapped file without decoding or copying.
+:func:`~stalta_tuner.utils.get_stream` fills the archive with what it fetches
+from a server and reads windows it has seen before from it. Writers of the
+same channel-day, in any thread or process, take turns on a lock file next
+to it.
+"""
+from contextlib import contextmanager
+import json
+import os
+import threading
+
+import numpy as np
+
+from obspy import Stream, Trace, UTCDateTime
+
+try:
+    import fcntl
+except ImportError:  # no file locks, e.g. on Windows
+    fcntl = None
+
+# where main.py and batch.py keep the archive unless the configuration sets one
+DEFAULT_ROOT = os.path.join(os.path.expanduser('~'), '.stalta_tuner', 'archive')
+
+# values of the state array
+MISSING = 0  # never fetched
+DATA = 1
+GAP = 2  # fetched, but the server had no data
+
+
+_LOCKS = {}  # path of a channel-day -> lock of this process
+_LOCKS_LOCK = threading.Lock()
+
+
+def _day(t):
+    t = UTCDateTime(t)
+    return UTCDateTime(t.year, t.month, t.day)
+
+
+@contextmanager
+def _locked(path):
+    """
+    Hold the lock of a channel-day: one lock per file for all threads of
+    this process, and a file lock for other processes.
+    """
+    with _LOCKS_LOCK:
+        lock = _LOCKS.setdefault(path, threading.Lock())
+    with lock, open(path + '.lock', 'a') as f:
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class Archive(object):
+    """
+    Memory-mapped channel-day archive in a directory.
+    :type root: str
+    :param root: Directory of the archive, created if missing.
+    :type min_age: float
+    :param min_age: Data younger than this (seconds) are not archived, as a
+        real-time server may still fill their gaps.
+    .. rubric:: Example
+    >>> archive = Archive('/tmp/archive')  # doctest: +SKIP
+    >>> archive.write('HSR.EHZ.UW.--', st, t1, t2)  # doctest: +SKIP
+    >>> archive.read('HSR.EHZ.UW.--', t1, t2, 100.)  # doctest: +SKIP
+    """
+    def __init__(self, root, min_age=3600.):
+        self.root = root
+        self.min_age = min_age
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, scnl, day, samprate):
+        sta, cha, net, loc = scnl.split('.')[:4]
+        folder = os.path.join(self.root, '.'.join([net, sta, loc.replace(
+            '--', ''), cha]))
+        return os.path.join(folder, '{}.{:03d}.{:g}Hz'.format(
+            day.year, day.julday, samprate))
+
+    def _open(self, scnl, day, samprate, mode='r', dtype=None):
+        """
+        Data and state arrays of a channel-day, created with ``dtype`` in
+        mode ``'r+'`` if missing, which must be done holding its lock.
+        ``None`` if missing in mode ``'r'``.
+        """
+        path = self._path(scnl, day, samprate)
+        if not os.path.exists(path + '.json'):
+            if mode == 'r':
+                return None
+            npts = int(round(86400 * samprate))
+            # unique names, as a writer without file locks may race this one
+            tmp = '.tmp-{}-{}'.format(os.getpid(), threading.get_ident())
+            for name, dt in [('.data.npy', dtype), ('.state.npy', np.uint8)]:
+                np.lib.format.open_memmap(path + name + tmp, mode='w+',
+                                          dtype=dt, shape=(npts,)).flush()
+                os.replace(path + name + tmp, path + name)
+            header = {'id': scnl, 'sampling_rate': samprate,
+                      'starttime': str(day), 'npts': npts,
+                      'dtype': np.dtype(dtype).name}
+            with open(path + '.json' + tmp, 'w') as f:
+                json.dump(header, f)
+            os.replace(path + '.json' + tmp, path + '.json')  # marks complete
+        return (np.load(path + '.data.npy', mmap_mode=mode),
+                np.load(path + '.state.npy', mmap_mode=mode))
+
+    def _upgrade(self, path, data):
+        """
+        Rewrite the int32 data of a channel-day as float32, for float data
+        to be stored without rounding. Must be done holding its lock.
+        :return: The new data array, memory-mapped in mode ``'r+'``
+        """
+        tmp = '.tmp-{}-{}'.format(os.getpid(), threading.get_ident())
+        new = np.lib.format.open_memmap(path + '.data.npy' + tmp, mode='w+',
+                                        dtype=np.float32, shape=data.shape)
+        new[:] = data
+        new.flush()
+        del new
+        os.replace(path + '.data.npy' + tmp, path + '.data.npy')
+        with open(path + '.json') as f:
+            header = json.load(f)
+        header['dtype'] = np.dtype(np.float32).name
+        with open(path + '.json' + tmp, 'w') as f:
+            json.dump(header, f)
+        os.replace(path + '.json' + tmp, path + '.json')
+        return np.load(path + '.data.npy', mmap_mode='r+')
+
+    def _days(self, tstart, tend):
+        day = _day(tstart)
+        while day <= tend:
+            yield day
+            day = _day(day + 86400 + 1)
+
+    def read(self, scnl, tstart, tend, samprate):
+        """
+        Data of a channel between two times, if all of it was archived.
+        :type scnl: str
+        :param scnl: Channel as ``'STA.CHA.NET.LOC'``
+        :type samprate: float
+        :param samprate: Sampling rate of the archive
+        :rtype: :class:`~obspy.core.stream.Stream` or None
+        :return: One trace per contiguous run of data, with the samples as
+            read-only slices of the memory-mapped files (copied only if the
+            period crosses midnight), or ``None`` if any sample between
+            ``tstart`` and ``tend`` has not been fetched yet.
+        """
+        tstart, tend = UTCDateTime(tstart), UTCDateTime(tend)
+        sta, cha, net, loc = scnl.split('.')[:4]
+        pieces = []
+        for day in self._days(tstart, tend):
+            arrays = self._open(scnl, day, samprate)
+            if arrays is None:
+                return None
+            data, state = arrays
+            i0 = max(int(round((tstart - day) * samprate)), 0)
+            i1 = min(int(round((tend - day) * samprate)) + 1, len(data))
+            if (state[i0:i1] == MISSING).any():
+                return None
+            pieces.append((day + i0 / samprate, data[i0:i1], state[i0:i1]))
+        t0, data, state = pieces[0]
+        if len(pieces) > 1:
+            # runs cut at midnight become one trace again
+            data = np.concatenate([piece[1] for piece in pieces])
+            state = np.concatenate([piece[2] for piece in pieces])
+        valid = np.concatenate(([False], state == DATA, [False]))
+        edges = np.flatnonzero(valid[1:] != valid[:-1]).reshape(-1, 2)
+        st = Stream()
+        for j0, j1 in edges:
+            tr = Trace(data=data[j0:j1])
+            tr.stats.network = net
+            tr.stats.station = sta
+            tr.stats.location = loc.replace('--', '')
+            tr.stats.channel = cha
+            tr.stats.sampling_rate = samprate
+            tr.stats.starttime = t0 + j0 / samprate
+            st.append(tr)
+        return st
+
+    def write(self, scnl, stream, tstart, tend, samprate):
+        """
+        Archive what a server returned for a channel between two times.
+        Samples of the period not covered by ``stream`` are marked as gaps,
+        samples of ``stream`` are stored at the nearest sample of the
+        archive's time grid. Samples younger than ``min_age`` are left out.
+        A channel-day is created as int32 if all traces of the stream are
+        integer, float32 otherwise, and is converted to float32 when float
+        data are written to an int32 one.
+        :type scnl: str
+        :param scnl: Channel as ``'STA.CHA.NET.LOC'``
+        :type stream: :class:`~obspy.core.stream.Stream`
+        :param stream: Traces of the channel, may be empty
+        :type samprate: float
+        :param samprate: Sampling rate of the archive, which all traces must
+            have
+        :rtype: bool
+        :return: Whether anything was archived
+        """
+        tstart = UTCDateTime(tstart)
+        tend = min(UTCDateTime(tend), UTCDateTime() - self.min_age)
+        if tend < tstart:
+            return False
+        if any(tr.stats.sampling_rate != samprate for tr in stream):
+            return False
+        # an empty stream says nothing about the data of the channel
+        integer = len(stream) > 0 and all(
+            np.issubdtype(tr.data.dtype, np.integer) for tr in stream)
+        for day in self._days(tstart, tend):
+            path = self._path(scnl, day, samprate)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with _locked(path):
+                data, state = self._open(scnl, day, samprate, mode='r+',
+                                         dtype=np.int32 if integer
+                                         else np.float32)
+                if np.issubdtype(data.dtype, np.integer) and not integer \
+                        and len(stream):
+                    data = self._upgrade(path, data)
+                i0 = max(int(round((tstart - day) * samprate)), 0)
+                i1 = min(int(round((tend - day) * samprate)) + 1, len(data))
+                period = state[i0:i1]
+                period[period == MISSING] = GAP
+                for tr in stream:
+                    k0 = int(round((tr.stats.starttime - day) * samprate))
+                    j0, j1 = max(k0, i0), min(k0 + tr.stats.npts, i1)
+                    if j1 <= j0:
+                        continue
+                    values = tr.data[j0 - k0:j1 - k0]
+                    if np.ma.isMaskedArray(values):
+                        keep = ~np.ma.getmaskarray(values)
+                        values = values.filled(0)
+                    else:
+                        keep = slice(None)
+                    data[j0:j1][keep] = values[keep]
+                    state[j0:j1][keep] = DATA
+                data.flush()
+                state.flush()
+        return True
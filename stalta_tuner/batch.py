@@ -0,0 +1,206 @@
+"""
+Batch detection over long periods.
+The period is cut into windows that are processed independently, e.g. by a
+process pool. Every window is fetched with some data before it, so that the
+filter and the characteristic function have settled when the window starts,
+and some data after it, so that triggers starting near its end are
+complete. Each window reports the triggers starting in it or in the first
+half of the data after it, so that an event at a boundary is found even if
+its start time comes out slightly different in the two windows, and
+:func:`merge_triggers` drops the second report of an event found by two
+neighbouring windows. Finished windows are recorded in a
+:class:`Checkpoint`, from which an interrupted run resumes.
+"""
+import csv
+import json
+import os
+
+from obspy import UTCDateTime
+
+from stalta_tuner.cache import preprocess
+from stalta_tuner.trigger import coincidence_trigger
+
+
+def batch_windows(tstart, tend, window):
+    """
+    Cut a period into consecutive windows.
+    :rtype: list of tuple
+    :return: ``(start, end)`` of each window, the last one shorter if needed
+    .. rubric:: Example
+    >>> batch_windows(UTCDateTime(0), UTCDateTime(2500), 1000)[-1]
+    (UTCDateTime(1970, 1, 1, 0, 33, 20), UTCDateTime(1970, 1, 1, 0, 41, 40))
+    """
+    tstart, tend = UTCDateTime(tstart), UTCDateTime(tend)
+    windows = []
+    t1 = tstart
+    while t1 < tend:
+        windows.append((t1, min(t1 + window, tend)))
+        t1 = t1 + window
+    return windows
+
+
+def detect_window(datasource, scnl, tstart, tend, trigger_type, thr_on,
+                  thr_off, thr_coincidence_sum, before=0., after=0.,
+                  spec=None, fetch_options=None, loader=None, **options):
+    """
+    Coincidence triggers starting in one window.
+    :type tstart: :class:`~obspy.core.utcdatetime.UTCDateTime`
+    :param tstart: Start of the window
+    :type tend: :class:`~obspy.core.utcdatetime.UTCDateTime`
+    :param tend: End of the window
+    :type before: float
+    :param before: Seconds fetched before the window to let the filter and
+        the characteristic function settle
+    :type after: float
+    :param after: Seconds fetched after the window to complete triggers
+        starting near its end, at least ``max_trigger_length``
+    :param spec: Preprocessing, see :func:`~stalta_tuner.cache.preprocess`
+    :type fetch_options: dict
+    :param fetch_options: Keyword arguments for the loader
+    :param loader: Function called like
+        :func:`~stalta_tuner.utils.get_stream`, which is the default.
+    :param options: Keyword arguments for
+        :func:`~stalta_tuner.trigger.coincidence_trigger`, e.g. ``sta`` and
+        ``lta``
+    :rtype: tuple
+    :return: Triggers starting between ``tstart`` and ``tend + after / 2``
+        as dicts of JSON types (``time`` as string, ``duration``,
+        ``coincidence_sum``, ``stations`` and ``trace_ids``) and the number
+        of traces read
+    """
+    if loader is None:
+        from stalta_tuner.utils import get_stream as loader
+    tstart, tend = UTCDateTime(tstart), UTCDateTime(tend)
+    st = loader(datasource, scnl, tstart - before, tend + after,
+                **(fetch_options or {}))
+    preprocess(st, spec)
+    _, triggers = coincidence_trigger(trigger_type, thr_on, thr_off, st,
+                                      thr_coincidence_sum, copy=False,
+                                      **options)
+    rows = [{'time': str(t['time']), 'duration': float(t['duration']),
+             'coincidence_sum': float(t['coincidence_sum']),
+             'stations': list(t['stations']),
+             'trace_ids': list(t['trace_ids'])}
+            for t in triggers if tstart <= t['time'] < tend + after / 2.]
+    return rows, len(st)
+
+
+def merge_triggers(windows, tolerance=1.):
+    """
+    Triggers of all windows in time order, each event once.
+    An event near the boundary of two neighbouring windows may be reported
+    by both, by the earlier one from the data after its end. Triggers of the
+    two windows with the same ``trace_ids`` and start times within
+    ``tolerance`` are such an event, and only the one from the window owning
+    its start time is kept, the earlier window owning the times before the
+    boundary. Triggers of one window are all kept, even if they overlap, as
+    a channel may trigger again while the network is still triggered.
+    :type windows: list of tuple
+    :param windows: ``(start, triggers)`` of each window, with the triggers
+        as returned by :func:`detect_window`
+    :type tolerance: float
+    :param tolerance: Seconds two start times of an event may differ by
+    :rtype: list of dict
+    """
+    windows = sorted(((UTCDateTime(tstart), rows) for tstart, rows in windows),
+                     key=lambda window: window[0])
+    dropped = [set() for _ in windows]  # indices of duplicates per window
+    for i in range(len(windows) - 1):
+        rows = windows[i][1]
+        boundary, later = windows[i + 1]
+        matched = set()
+        for k, row in enumerate(rows):
+            time = UTCDateTime(row['time'])
+            for j, other in enumerate(later):
+                if j not in matched and \
+                        sorted(other['trace_ids']) == sorted(row['trace_ids']) \
+                        and abs(UTCDateTime(other['time']) - time) <= tolerance:
+                    matched.add(j)
+                    if time < boundary:
+                        dropped[i + 1].add(j)
+                    else:
+                        dropped[i].add(k)
+                    break
+    merged = [row for (_, rows), drop in zip(windows, dropped)
+              for k, row in enumerate(rows) if k not in drop]
+    return sorted(merged, key=lambda row: UTCDateTime(row['time']))
+
+
+def write_catalog(path, rows):
+    """
+    Write triggers to a CSV file, replacing it atomically.
+    Columns are ``time``, ``duration``, ``coincidence_sum``, ``stations``
+    and ``trace_ids``, the last two as space separated lists.
+    """
+    tmp = path + '.tmp'
+    with open(tmp, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['time', 'duration', 'coincidence_sum', 'stations',
+                         'trace_ids'])
+        for row in rows:
+            writer.writerow([row['time'], row['duration'],
+                             row['coincidence_sum'], ' '.join(row['stations']),
+                             ' '.join(row['trace_ids'])])
+    os.replace(tmp, path)
+
+
+class Checkpoint(object):
+    """
+    Results of finished windows in a JSON lines file.
+    The first line holds the parameters of the run, every further line the
+    start time, triggers and number of traces of one window. Lines are
+    flushed to disk as windows finish, so a run that is interrupted resumes
+    with the windows that are missing.
+    :type path: str
+    :param path: File of the checkpoint, created if missing.
+    :type params: dict
+    :param params: Parameters of the run, of JSON types. Resuming with
+        other parameters raises a :class:`ValueError`.
+    """
+    def __init__(self, path, params):
+        self.path = path
+        self.done = {}  # window start -> (triggers, number of traces)
+        params = json.loads(json.dumps(params))  # as read back
+        if os.path.exists(path):
+            with open(path) as f:
+                text = f.read()
+            if not text.endswith('\n'):
+                with open(path, 'a') as f:
+                    f.write('\n')  # end a line cut off by an interruption
+            lines = text.splitlines()
+            if not lines or json.loads(lines[0]) != params:
+                raise ValueError('Checkpoint {} was written for other '
+                                 'parameters'.format(path))
+            for line in lines[1:]:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # cut off by an interruption
+                self.done[entry['window']] = (entry['triggers'],
+                                              entry['ntraces'])
+        else:
+            with open(path, 'w') as f:
+                f.write(json.dumps(params) + '\n')
+
+    def __contains__(self, tstart):
+        return str(UTCDateTime(tstart)) in self.done
+
+    def add(self, tstart, rows, ntraces):
+        """
+        Record a finished window.
+        """
+        window = str(UTCDateTime(tstart))
+        with open(self.path, 'a') as f:
+            f.write(json.dumps({'window': window, 'triggers': rows,
+                                'ntraces': ntraces}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.done[window] = (rows, ntraces)
+
+    def triggers(self):
+        """
+        Triggers of all finished windows, merged (see
+        :func:`merge_triggers`).
+        """
+        return merge_triggers([(window, rows) for window, (rows, _)
+                               in self.done.items()])
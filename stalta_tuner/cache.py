@@ -0,0 +1,252 @@
+"""
+In-memory waveform cache.
+Streams are kept by (datasource, SCNL list, start, end, preprocessing), both
+raw as fetched and after preprocessing, so that going back to a window that
+was already shown neither repeats the request to the server nor the
+filtering. Entries are evicted least recently used first once the data
+exceed a byte budget.
+:data:`SHARED_CACHE` is one cache for the whole process, which all Bokeh
+sessions of a ``bokeh serve`` process use. Concurrent requests for the same
+key are loaded once (single-flight): the first caller loads, the others
+wait for its result.
+"""
+from collections import OrderedDict
+from concurrent.futures import Future
+import threading
+
+from obspy import UTCDateTime
+
+
+def _freeze(value):
+    """
+    Hashable version of a preprocessing spec made of lists, tuples and
+    dicts.
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def stream_nbytes(stream):
+    """
+    Bytes held by the data arrays of a stream.
+    """
+    return sum(tr.data.nbytes for tr in stream)
+
+
+def preprocess(stream, spec):
+    """
+    Apply a preprocessing spec to a stream inplace.
+    :type stream: :class:`~obspy.core.stream.Stream`
+    :param stream: Waveform data
+    :type spec: list of (str, dict)
+    :param spec: Stream methods and their keyword arguments, applied in
+        order, e.g. ``[('filter', {'type': 'bandpass', 'freqmin': 0.5,
+        'freqmax': 3})]``.
+    :rtype: :class:`~obspy.core.stream.Stream`
+    """
+    for method, kwargs in spec or []:
+        getattr(stream, method)(**kwargs)
+    return stream
+
+
+class WaveformCache(object):
+    """
+    Memory-bounded LRU cache of raw and preprocessed streams.
+    :type max_bytes: int
+    :param max_bytes: Budget for the data arrays of all cached streams.
+        Streams larger than the budget are not cached.
+    :type disk: :class:`~stalta_tuner.diskcache.DiskCache`, optional
+    :param disk: Cache looked up before loading a stream and filled with
+        what is loaded, e.g. one shared with other processes. Streams read
+        from it are kept in memory as its read-only memory maps.
+    .. rubric:: Example
+    >>> cache = WaveformCache(max_bytes=512 * 2**20)
+    >>> spec = [('filter', {'type': 'bandpass', 'freqmin': 0.5,
+    ...                     'freqmax': 3})]
+    >>> st = cache.get_stream('IRIS', ['HSR.EHZ.UW.--'], t1, t2,
+    ...                       spec)  # doctest: +SKIP
+    >>> cache.stats()  # doctest: +SKIP
+    {'hits': 0, 'misses': 2, 'evictions': 0, 'entries': 2, ...}
+    """
+    def __init__(self, max_bytes=512 * 2**20, disk=None):
+        self.max_bytes = max_bytes
+        self.disk = disk
+        self._entries = OrderedDict()  # key -> (stream, nbytes)
+        self._loading = {}  # key -> future of the load in progress
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        """
+        Drop all entries and reset the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+            self.bytes_hit = 0
+            self.bytes_loaded = 0
+            self.waits = 0
+
+    def resize(self, max_bytes):
+        """
+        Change the byte budget, evicting entries if it shrinks.
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.nbytes -= evicted
+            self.evictions += 1
+
+    @staticmethod
+    def key(datasource, scnl, tstart, tend, spec=None):
+        """
+        Cache key of a request. ``spec=None`` is the raw stream.
+        """
+        return (datasource, tuple(scnl), UTCDateTime(tstart).ns,
+                UTCDateTime(tend).ns, _freeze(spec or []))
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key, copy=True):
+        """
+        Look up a stream and mark it as recently used.
+        :param key: see :meth:`key`
+        :type copy: bool
+        :param copy: Return a copy, so that changing it does not change the
+            cached stream.
+        :return: The stream, or ``None`` on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.bytes_hit += entry[1]
+        return entry[0].copy() if copy else entry[0]
+
+    def put(self, key, stream, copy=True):
+        """
+        Store a stream, evicting least recently used entries as needed.
+        :param key: see :meth:`key`
+        :type copy: bool
+        :param copy: Store a copy, so that later changes of ``stream`` do not
+            reach the cache.
+        """
+        nbytes = stream_nbytes(stream)
+        if nbytes > self.max_bytes:
+            return
+        if copy:
+            stream = stream.copy()
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            self._entries[key] = (stream, nbytes)
+            self.nbytes += nbytes
+            self._evict()
+
+    def get_or_load(self, key, load, copy=True):
+        """
+        Look up a stream and load it on a miss, once for all threads asking
+        for it at the same time.
+        :param key: see :meth:`key`
+        :param load: Called without arguments on a miss, returns the stream
+        :type copy: bool
+        :param copy: Keep the cached stream and the one returned apart, as
+            in :meth:`get` and :meth:`put`. With ``False`` all callers share
+            one stream, which must then not be changed.
+        :rtype: :class:`~obspy.core.stream.Stream`
+        """
+        with self._lock:
+            st = self.get(key, copy=copy)
+            if st is not None:
+                return st
+            future = self._loading.get(key)
+            first = future is None
+            if first:
+                future = self._loading[key] = Future()
+            else:
+                self.waits += 1
+        if not first:
+            st = future.result()  # raises what the first caller's load did
+            return st.copy() if copy else st
+        try:
+            if self.disk is None:
+                st = load()
+                stored = st.copy() if copy else st
+            else:
+                stored = self.disk.get_or_load(key, load)
+                st = stored.copy() if copy else stored
+            self.put(key, stored, copy=False)
+            future.set_result(stored)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._loading[key]
+        return st
+
+    def get_stream(self, datasource, scnl, tstart, tend, spec=None,
+                   loader=None, **kwargs):
+        """
+        Fetch a preprocessed stream through the cache.
+        A miss on the preprocessed stream falls back to the cached raw
+        stream, and only a miss on both calls the loader.
+        :type spec: list of (str, dict)
+        :param spec: Preprocessing, see :func:`preprocess`
+        :param loader: Function called like
+            :func:`~stalta_tuner.utils.get_stream` on a miss, which is the
+            default.
+        :param kwargs: Further keyword arguments for the loader
+        :rtype: :class:`~obspy.core.stream.Stream`
+        :return: A copy of the cached stream
+        """
+        if loader is None:
+            from stalta_tuner.utils import get_stream as loader
+        def fetch():
+            st = loader(datasource, scnl, tstart, tend, **kwargs)
+            with self._lock:
+                self.bytes_loaded += stream_nbytes(st)
+            return st
+
+        key = self.key(datasource, scnl, tstart, tend, spec)
+        if not spec:
+            return self.get_or_load(key, fetch)
+        raw_key = self.key(datasource, scnl, tstart, tend)
+        return self.get_or_load(key, lambda: preprocess(
+            self.get_or_load(raw_key, fetch), spec))
+
+    def stats(self):
+        """
+        Counters for sizing the cache.
+        :rtype: dict
+        :return: ``hits`` and ``misses`` of :meth:`get`, ``evictions``,
+            number of ``entries``, ``nbytes`` held and ``max_bytes``,
+            ``bytes_hit`` served from the cache, ``bytes_loaded`` by the
+            loader and ``waits`` for a load already in progress.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions,
+                    'entries': len(self._entries), 'nbytes': self.nbytes,
+                    'max_bytes': self.max_bytes, 'bytes_hit': self.bytes_hit,
+                    'bytes_loaded': self.bytes_loaded, 'waits': self.waits}
+
+
+# shared by all Bokeh sessions in this process
+SHARED_CACHE = WaveformCache()
@@ -0,0 +1,175 @@
+"""
+Pool of waveform server clients shared across calls.
+Creating an FDSN client runs service discovery against the server (several
+HTTP requests), and an Earthworm client is rebuilt from its address on every
+call. The pool keeps one client per datasource and timeout for the lifetime
+of the process, so that all fetches and all Bokeh sessions reuse it. Clients
+that were idle longer than the health check interval are checked before
+they are handed out again and replaced if their server does not answer.
+"""
+from collections import OrderedDict
+import socket
+import threading
+import time
+
+
+def make_client(datasource, timeout=None):
+    """
+    Client for a datasource as used by :func:`~stalta_tuner.utils.get_stream`:
+    ``'host:port'`` for an Earthworm waveserver, otherwise the name of an
+    FDSN provider known to ObsPy, e.g. ``'IRIS'``. URLs are not supported,
+    as get_stream takes any datasource with a ``'/'`` for a directory.
+    """
+    kwargs = {} if timeout is None else {'timeout': timeout}
+    if '.' not in datasource:
+        from obspy.clients.fdsn import Client
+        return Client(datasource, **kwargs)
+    from obspy.clients.earthworm import Client as EWClient
+    host, port = datasource.split(':')
+    return EWClient(host, int(port), **kwargs)
+
+
+def check_client(client, timeout=5.):
+    """
+    Whether the server of a client answers.
+    Earthworm clients must accept a TCP connection, FDSN clients must answer
+    an HTTP request to their base URL with any status. Other clients are
+    taken as healthy.
+    :rtype: bool
+    """
+    if hasattr(client, 'host') and hasattr(client, 'port'):
+        try:
+            socket.create_connection((client.host, client.port),
+                                     timeout=timeout).close()
+            return True
+        except OSError:
+            return False
+    if hasattr(client, 'base_url'):
+        from urllib.error import HTTPError
+        from urllib.request import urlopen
+        try:
+            urlopen(client.base_url, timeout=timeout).close()
+        except HTTPError:
+            pass  # the server answered
+        except (OSError, ValueError):
+            return False
+        return True
+    return True
+
+
+class ClientPool(object):
+    """
+    Clients by (datasource, timeout), least recently used dropped first.
+    :type max_size: int
+    :param max_size: Number of clients kept.
+    :type health_interval: float
+    :param health_interval: Clients idle for longer than this (seconds) are
+        checked before reuse.
+    :param factory: Called as ``factory(datasource, timeout)`` to create a
+        client, :func:`make_client` by default.
+    :param check: Called as ``check(client)`` for the health check,
+        :func:`check_client` by default.
+    .. rubric:: Example
+    >>> pool = ClientPool(factory=lambda datasource, timeout: object())
+    >>> pool.get('IRIS') is pool.get('IRIS')
+    True
+    >>> pool.stats()['reused']
+    1
+    """
+    def __init__(self, max_size=8, health_interval=300., factory=None,
+                 check=None):
+        self.max_size = max_size
+        self.health_interval = health_interval
+        self.factory = factory or make_client
+        self.check = check or check_client
+        self._lock = threading.Lock()
+        self._clients = OrderedDict()  # key -> [client, setup s, last use]
+        self.clear()
+
+    def clear(self):
+        """
+        Drop all clients and reset the counters.
+        """
+        with self._lock:
+            self._clients.clear()
+            self.created = 0
+            self.reused = 0
+            self.checks = 0
+            self.failed_checks = 0
+            self.discarded = 0
+            self.evicted = 0
+            self.setup_seconds = 0.
+            self.saved_seconds = 0.
+
+    def get(self, datasource, timeout=None):
+        """
+        The pooled client of a datasource, created if needed.
+        The returned client may be used by several threads at once.
+        """
+        key = (datasource, timeout)
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry is not None:
+                self._clients.move_to_end(key)
+        if entry is not None:
+            healthy = True
+            if time.time() - entry[2] > self.health_interval:
+                healthy = self.check(entry[0])
+                with self._lock:
+                    self.checks += 1
+                    self.failed_checks += not healthy
+            if healthy:
+                with self._lock:
+                    entry[2] = time.time()
+                    self.reused += 1
+                    self.saved_seconds += entry[1]
+                return entry[0]
+            self.discard(datasource, timeout)
+        t = time.time()
+        client = self.factory(datasource, timeout)
+        setup = time.time() - t
+        with self._lock:
+            self.created += 1
+            self.setup_seconds += setup
+            self._clients[key] = [client, setup, time.time()]
+            self._clients.move_to_end(key)
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+                self.evicted += 1
+        return client
+
+    def discard(self, datasource, timeout=None):
+        """
+        Drop the client of a datasource, e.g. after its requests failed, so
+        that the next :meth:`get` creates a new one.
+        """
+        with self._lock:
+            if self._clients.pop((datasource, timeout), None) is not None:
+                self.discarded += 1
+
+    def stats(self):
+        """
+        Counters of the pool.
+        :rtype: dict
+        :return: Number of clients ``created`` and ``reused``, health
+            ``checks`` and ``failed_checks``, clients ``discarded`` and
+            ``evicted``, the current ``size``, the time spent creating
+            clients (``setup_seconds``), the setup time saved by reuse
+            (``saved_seconds``, the setup time of each reused client once per
+            reuse) and ``saved_per_fetch`` in seconds.
+        """
+        with self._lock:
+            fetches = self.created + self.reused
+            return {'created': self.created, 'reused': self.reused,
+                    'checks': self.checks,
+                    'failed_checks': self.failed_checks,
+                    'discarded': self.discarded, 'evicted': self.evicted,
+                    'size': len(self._clients),
+                    'setup_seconds': self.setup_seconds,
+                    'saved_seconds': self.saved_seconds,
+                    'saved_per_fetch': self.saved_seconds / fetches
+                    if fetches else 0.}
+
+
+# shared by all calls of get_stream in this process
+CLIENT_POOL = ClientPool()
@@ -0,0 +1,70 @@
+"""
+Decimation of waveforms for plotting.
+A line plot cannot show more than one column of pixels per horizontal
+pixel. Keeping only the smallest and the largest sample of each
+pixel-wide bucket draws the same picture as all samples (every peak and
+trough is kept, in time order) with at most two points per pixel, so the
+points sent to the browser are bounded by the plot width instead of the
+length of the trace.
+"""
+import numpy as np
+
+
+def minmax_indices(data, n_buckets, start=0, stop=None):
+    """
+    Indices of the smallest and the largest sample in each of ``n_buckets``
+    equal buckets of ``data[start:stop]``, in increasing order.
+    All indices of the span are returned if it has no more than
+    ``2 * n_buckets`` samples, i.e. the span is then at full resolution.
+    :type data: NumPy :class:`~numpy.ndarray`
+    :param data: Waveform samples
+    :type n_buckets: int
+    :param n_buckets: Number of buckets, typically the plot width in pixels
+    :type start: int
+    :param start: First sample of the span
+    :type stop: int or None
+    :param stop: Sample after the end of the span, ``len(data)`` if ``None``
+    :rtype: NumPy :class:`~numpy.ndarray`
+    :return: int64 indices into ``data``
+    .. rubric:: Example
+    >>> minmax_indices(np.array([0, 5, -3, 1, 2, 8, 4, 4]), 2)
+    array([1, 2, 4, 5])
+    """
+    stop = len(data) if stop is None else min(stop, len(data))
+    start = max(start, 0)
+    npts = stop - start
+    if npts <= 2 * n_buckets:
+        return np.arange(start, max(stop, start), dtype=np.int64)
+    width = -(-npts // n_buckets)  # ceil, so that no more than n_buckets
+    nfull = npts // width
+    blocks = data[start:start + nfull * width].reshape(nfull, width)
+    first = np.arange(nfull, dtype=np.int64) * width
+    imin = first + blocks.argmin(axis=1)
+    imax = first + blocks.argmax(axis=1)
+    if nfull * width < npts:  # shorter last bucket
+        rest = data[start + nfull * width:stop]
+        imin = np.append(imin, nfull * width + rest.argmin())
+        imax = np.append(imax, nfull * width + rest.argmax())
+    pairs = np.sort(np.stack((imin, imax), axis=1), axis=1).ravel()
+    # flat buckets have the same sample as minimum and maximum
+    pairs = pairs[np.concatenate(([True], pairs[1:] != pairs[:-1]))]
+    return pairs + start
+
+
+def view_indices(data, n_buckets, start=0, stop=None):
+    """
+    Indices of the samples to plot for a view of ``data[start:stop]``.
+    The view gets ``n_buckets`` buckets of :func:`minmax_indices`, and so
+    full resolution once it is zoomed in far enough. The samples before and
+    after it get ``n_buckets // 2`` buckets each, so that panning or zooming
+    out shows the rest of the trace at a coarser resolution until the
+    plot is updated for the new view.
+    :rtype: NumPy :class:`~numpy.ndarray`
+    :return: int64 indices into ``data``, at most ``4 * n_buckets``
+    """
+    stop = len(data) if stop is None else min(stop, len(data))
+    start = min(max(start, 0), stop)
+    outer = max(n_buckets // 2, 1)
+    return np.concatenate((minmax_indices(data, outer, 0, start),
+                           minmax_indices(data, n_buckets, start, stop),
+                           minmax_indices(data, outer, stop, len(data))))
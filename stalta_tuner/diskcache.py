@@ -0,0 +1,296 @@
+"""
+On-disk cache of streams shared by processes.
+``bokeh serve --num-procs`` runs several server processes, each with its
+own :data:`~stalta_tuner.cache.SHARED_CACHE`. A :class:`DiskCache` behind
+those caches lets every process reuse the windows, filtered data and
+characteristic functions any of them computed.
+Entries are addressed by the SHA-256 of their cache key (see
+:meth:`~stalta_tuner.cache.WaveformCache.key`), one directory per entry
+with a ``.npy`` file per trace and a JSON header. An entry is written to a
+temporary directory and renamed into place, so readers never see a partial
+one, and is read back through :func:`numpy.load` with ``mmap_mode='r'``.
+While one process computes an entry, others asking for the same key wait
+on a file lock instead of computing it too. Entries are evicted least
+recently read first once the directory exceeds its byte budget. Each
+process keeps a running total of the size of the directory, which only
+includes what other processes wrote once it is scanned again, at most
+every ``rescan`` seconds.
+"""
+from contextlib import contextmanager
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+from obspy import Stream, Trace, UTCDateTime
+
+try:
+    import fcntl
+except ImportError:  # no file locks, e.g. on Windows; writes stay atomic
+    fcntl = None
+
+META = 'meta.json'
+
+
+@contextmanager
+def _locked(path, blocking=True):
+    """
+    Hold an exclusive lock on a file. Yields whether the lock was taken,
+    which is always the case if ``blocking``. A lock file deleted by
+    :meth:`DiskCache.evict` while waiting for it is created again, so that
+    all holders lock the same file.
+    """
+    while True:
+        with open(path, 'a') as f:
+            if fcntl is None:
+                yield True
+                return
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX |
+                            (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                if os.stat(path).st_ino != os.fstat(f.fileno()).st_ino:
+                    continue  # deleted meanwhile; lock the new one
+            except FileNotFoundError:
+                continue
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            return
+
+
+class DiskCache(object):
+    """
+    Directory of cached streams, safe to share between processes.
+    :type root: str
+    :param root: Directory of the cache, created if missing.
+    :type max_bytes: int
+    :param max_bytes: Budget for the files of all entries.
+    :type rescan: float
+    :param rescan: Seconds after which the size of the directory is read
+        again from the headers of all entries, to account for entries
+        written and evicted by other processes.
+    .. rubric:: Example
+    >>> disk = DiskCache('/tmp/stalta_tuner_cache')  # doctest: +SKIP
+    >>> st = disk.get_or_load(key, lambda: get_stream(...))  # doctest: +SKIP
+    >>> disk.stats()  # doctest: +SKIP
+    {'hits': 0, 'misses': 1, 'writes': 1, 'evictions': 0, ...}
+    """
+    def __init__(self, root, max_bytes=4 * 2**30, rescan=60.):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.rescan = rescan
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(root, 'locks'), exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.entries = 0  # on disk, as of the last scan and changes since
+        self.nbytes = 0
+        self._scanned = None  # time of the last scan
+        self._scan()
+
+    @staticmethod
+    def digest(key):
+        """
+        Address of a cache key: the SHA-256 of its ``repr``, which is the
+        same in every process for keys made of strings, numbers and tuples.
+        """
+        return hashlib.sha256(repr(key).encode()).hexdigest()
+
+    def _path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def _lock_path(self, digest):
+        # one per key, as a load may load other keys while holding its lock
+        return os.path.join(self.root, 'locks', digest + '.lock')
+
+    def _count(self, **counts):
+        with self._lock:
+            for name, n in counts.items():
+                setattr(self, name, getattr(self, name) + n)
+
+    def _read(self, digest, count=True):
+        path = self._path(digest)
+        try:
+            with open(os.path.join(path, META)) as f:
+                meta = json.load(f)
+            st = Stream()
+            for i, header in enumerate(meta['traces']):
+                data = np.load(os.path.join(path, '{}.npy'.format(i)),
+                               mmap_mode='r' if header['npts'] else None)
+                tr = Trace(data=data)
+                for name in ('network', 'station', 'location', 'channel'):
+                    tr.stats[name] = header[name]
+                tr.stats.sampling_rate = header['sampling_rate']
+                tr.stats.starttime = UTCDateTime(header['starttime'])
+                if header.get('gaps') is not None:
+                    tr.stats.gaps = np.array(header['gaps'],
+                                             dtype=np.int64).reshape(-1, 2)
+                st.append(tr)
+            os.utime(path)  # marks it as recently read for the eviction
+        except (OSError, ValueError):
+            return None  # missing, or evicted while reading
+        if count:
+            self._count(hits=1, bytes_read=meta['nbytes'])
+        return st
+
+    def _write(self, digest, stream):
+        if any(np.ma.isMaskedArray(tr.data) or tr.data.dtype.hasobject
+               for tr in stream):
+            return False
+        path = self._path(digest)
+        tmp = '{}.tmp-{}-{}'.format(path, os.getpid(), threading.get_ident())
+        try:
+            os.makedirs(tmp, exist_ok=True)  # left over if a write failed
+            headers = []
+            for i, tr in enumerate(stream):
+                np.save(os.path.join(tmp, '{}.npy'.format(i)), tr.data)
+                gaps = tr.stats.get('gaps')
+                headers.append({
+                    'network': tr.stats.network, 'station': tr.stats.station,
+                    'location': tr.stats.location,
+                    'channel': tr.stats.channel,
+                    'sampling_rate': tr.stats.sampling_rate,
+                    'starttime': str(tr.stats.starttime),
+                    'npts': tr.stats.npts,
+                    'gaps': None if gaps is None else np.asarray(gaps).tolist()})
+            nbytes = sum(os.path.getsize(os.path.join(tmp, name))
+                         for name in os.listdir(tmp))
+            with open(os.path.join(tmp, META), 'w') as f:
+                json.dump({'traces': headers, 'nbytes': nbytes}, f)
+            os.rename(tmp, path)  # the entry appears complete or not at all
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)  # e.g. written meanwhile
+            return False
+        self._count(writes=1, bytes_written=nbytes, entries=1, nbytes=nbytes)
+        return True
+
+    def get(self, key):
+        """
+        Look up a stream.
+        :return: The stream with read-only memory-mapped data, or ``None``
+            on a miss
+        """
+        st = self._read(self.digest(key))
+        if st is None:
+            self._count(misses=1)
+        return st
+
+    def get_or_load(self, key, load):
+        """
+        Look up a stream and load and store it on a miss. Processes and
+        threads asking for the same key at the same time wait for the one
+        loading it.
+        :param load: Called without arguments on a miss, returns the stream
+        :rtype: :class:`~obspy.core.stream.Stream`
+        :return: The stream with read-only memory-mapped data, or as
+            returned by ``load`` if it could not be stored
+        """
+        digest = self.digest(key)
+        st = self._read(digest)
+        if st is not None:
+            return st
+        with _locked(self._lock_path(digest)):
+            st = self._read(digest)  # stored while waiting for the lock
+            if st is not None:
+                return st
+            self._count(misses=1)
+            st = load()
+            if not self._write(digest, st):
+                return st
+        if self.nbytes > self.max_bytes or \
+                time.time() - self._scanned > self.rescan:
+            self.evict()
+        return self._read(digest, count=False) or st
+
+    def _entries(self):
+        """
+        ``(last read, nbytes, path)`` of all complete entries.
+        """
+        entries = []
+        for prefix in os.listdir(self.root):
+            folder = os.path.join(self.root, prefix)
+            if prefix == 'locks' or not os.path.isdir(folder):
+                continue
+            for name in os.listdir(folder):
+                path = os.path.join(folder, name)
+                try:
+                    with open(os.path.join(path, META)) as f:
+                        nbytes = json.load(f)['nbytes']
+                    entries.append((os.stat(path).st_mtime, nbytes, path))
+                except (OSError, ValueError):
+                    continue  # temporary, or evicted meanwhile
+        return entries
+
+    def _scan(self):
+        """
+        Read the size of the cache from disk.
+        :return: Entries as returned by :meth:`_entries`
+        """
+        entries = self._entries()
+        with self._lock:
+            self.entries = len(entries)
+            self.nbytes = sum(entry[1] for entry in entries)
+            self._scanned = time.time()
+        return entries
+
+    def evict(self):
+        """
+        Scan the cache and delete least recently read entries until it fits
+        its budget. Skipped if another process is evicting already. Processes
+        reading an evicted entry keep their memory maps of it.
+        :rtype: int
+        :return: Number of entries deleted
+        """
+        evicted = 0
+        with _locked(os.path.join(self.root, 'locks', 'evict.lock'),
+                     blocking=False) as locked:
+            if not locked:
+                return 0
+            entries = sorted(self._scan())
+            nbytes = sum(entry[1] for entry in entries)
+            for _, size, path in entries:
+                if nbytes <= self.max_bytes:
+                    break
+                shutil.rmtree(path, ignore_errors=True)
+                # its lock file goes too unless a load holds it; waiting
+                # loads notice and lock a new one (see _locked)
+                lock_path = self._lock_path(os.path.basename(path))
+                with _locked(lock_path, blocking=False) as free:
+                    if free:
+                        os.remove(lock_path)
+                nbytes -= size
+                evicted += 1
+                self._count(entries=-1, nbytes=-size)
+        self._count(evictions=evicted)
+        return evicted
+
+    def stats(self):
+        """
+        Counters of this process and the size of the cache, without reading
+        the disk.
+        :rtype: dict
+        :return: ``hits``, ``misses``, ``writes`` and ``evictions`` of this
+            process, ``bytes_read`` and ``bytes_written`` by it, and the
+            ``entries`` and ``nbytes`` on disk as of the last scan and the
+            changes by this process since, with ``max_bytes``.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'writes': self.writes, 'evictions': self.evictions,
+                    'bytes_read': self.bytes_read,
+                    'bytes_written': self.bytes_written,
+                    'entries': self.entries, 'nbytes': self.nbytes,
+                    'max_bytes': self.max_bytes}
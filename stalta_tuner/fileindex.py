@@ -0,0 +1,172 @@
+"""
+Persistent header index for waveform files in a directory tree.
+Reading the headers of every file on every fetch is what makes large
+archives slow. The index keeps path, modification time, size, SEED id,
+start and end time and sampling rate of every trace in an SQLite database.
+Only files that are new or changed since the last update are read again,
+and a fetch asks the index which files overlap its time range and stations.
+"""
+import contextlib
+import hashlib
+import os
+import sqlite3
+
+INDEX_NAME = '.stalta_tuner_index.sqlite'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS traces (
+    path TEXT NOT NULL REFERENCES files(path) ON DELETE CASCADE,
+    network TEXT,
+    station TEXT,
+    location TEXT,
+    channel TEXT,
+    starttime REAL NOT NULL,
+    endtime REAL NOT NULL,
+    sampling_rate REAL
+);
+CREATE INDEX IF NOT EXISTS traces_station_time
+    ON traces (station, starttime, endtime);
+CREATE INDEX IF NOT EXISTS traces_path ON traces (path);
+"""
+
+
+def default_index_path(root):
+    """
+    Where the index of a directory tree is kept: inside the tree if it is
+    writable, otherwise in ``~/.stalta_tuner`` under a name derived from the
+    absolute path of the tree.
+    :type root: str
+    :param root: Top directory of the waveform files
+    :rtype: str
+    """
+    root = os.path.abspath(root)
+    if os.access(root, os.W_OK):
+        return os.path.join(root, INDEX_NAME)
+    digest = hashlib.sha1(root.encode('utf-8')).hexdigest()[:16]
+    folder = os.path.join(os.path.expanduser('~'), '.stalta_tuner')
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, 'index_{}.sqlite'.format(digest))
+
+
+class HeaderIndex(object):
+    """
+    SQLite index of the trace headers of waveform files.
+    Every method opens its own connection, so an index can be shared by
+    several threads or processes.
+    :type path: str
+    :param path: Database file, created if missing.
+    .. rubric:: Example
+    >>> index = HeaderIndex(default_index_path(root))  # doctest: +SKIP
+    >>> index.update(files)  # doctest: +SKIP
+    >>> index.query(['HSR'], tstart, tend)  # doctest: +SKIP
+    """
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as con:
+            con.executescript(_SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        con = sqlite3.connect(self.path, timeout=60)
+        try:
+            con.execute('PRAGMA foreign_keys = ON')
+            with con:  # commits, or rolls back on error
+                yield con
+        finally:
+            con.close()
+
+    def update(self, files, prune=None):
+        """
+        Bring the index up to date with a list of files.
+        Headers are read only for files whose modification time or size
+        changed since they were indexed. Files that cannot be read as
+        waveforms are indexed without traces, so they are not read again
+        until they change.
+        :type files: list of str
+        :param files: Waveform files
+        :type prune: str, optional
+        :param prune: Directory; indexed files below it that are not in
+            ``files`` any more are dropped from the index.
+        :rtype: int
+        :return: Number of files whose headers were read
+        """
+        import obspy
+
+        files = [os.path.abspath(f) for f in files]
+        with self._connect() as con:
+            known = dict((row[0], (row[1], row[2])) for row in
+                         con.execute('SELECT path, mtime, size FROM files'))
+        changed = []
+        for f in files:
+            try:
+                stat = os.stat(f)
+            except OSError:
+                continue
+            if known.get(f) != (stat.st_mtime, stat.st_size):
+                changed.append((f, stat.st_mtime, stat.st_size))
+
+        rows = []
+        for f, mtime, size in changed:
+            try:
+                stmp = obspy.read(f, headonly=True)
+            except Exception:
+                stmp = []
+            rows.append(((f, mtime, size),
+                         [(f, tr.stats.network, tr.stats.station,
+                           tr.stats.location, tr.stats.channel,
+                           tr.stats.starttime.timestamp,
+                           tr.stats.endtime.timestamp,
+                           tr.stats.sampling_rate) for tr in stmp]))
+
+        with self._connect() as con:
+            if prune is not None:
+                prefix = os.path.join(os.path.abspath(prune), '')
+                gone = set(p for p in known if p.startswith(prefix)) - \
+                    set(files)
+                con.executemany('DELETE FROM files WHERE path = ?',
+                                [(p,) for p in gone])
+            for file_row, trace_rows in rows:
+                con.execute('DELETE FROM files WHERE path = ?', file_row[:1])
+                con.execute('INSERT INTO files VALUES (?, ?, ?)', file_row)
+                con.executemany(
+                    'INSERT INTO traces VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    trace_rows)
+        return len(changed)
+
+    def query(self, stations, tstart, tend, networks=None, locations=None,
+              channels=None):
+        """
+        Files holding data of the given stations between two times.
+        :type stations: list of str
+        :param stations: Station codes
+        :type tstart: :class:`~obspy.core.utcdatetime.UTCDateTime`
+        :param tstart: Start of period of interest
+        :type tend: :class:`~obspy.core.utcdatetime.UTCDateTime`
+        :param tend: End of period of interest
+        :type networks: list of str, optional
+        :param networks: Network codes, any if not given. Same for
+            ``locations`` and ``channels``.
+        :rtype: list of str
+        :return: Paths of the files with at least one matching trace that
+            overlaps the period, sorted
+        """
+        sql = 'SELECT DISTINCT path FROM traces WHERE starttime <= ? ' + \
+            'AND endtime >= ?'
+        args = [tend.timestamp, tstart.timestamp]
+        for column, values in [('station', stations), ('network', networks),
+                               ('location', locations),
+                               ('channel', channels)]:
+            if values is None:
+                continue
+            values = sorted(set(values))
+            sql += ' AND {} IN ({})'.format(column,
+                                            ', '.join('?' * len(values)))
+            args.extend(values)
+        with self._connect() as con:
+            return [row[0] for row in
+                    con.execute(sql + ' ORDER BY path', args)]
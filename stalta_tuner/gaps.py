@@ -0,0 +1,96 @@
+"""
+Gaps in waveform data.
+Gaps (missing data, Winston NaN tokens, padding to the requested period) are
+filled in place so that filters and characteristic functions can run over
+them, and their positions are kept with the trace in
+``trace.stats.gaps``: the boolean gap mask in run-length form, an ``(n, 2)``
+array of ``[start, end)`` sample indices. It is small, survives copies and
+filtering of the trace, and lets :func:`~stalta_tuner.trigger.trigger_onset`
+drop triggers inside or right after a gap without allocating anything of
+the length of the trace.
+"""
+import numpy as np
+
+from obspy import Stream, Trace
+
+# integer value Winston waveservers send for missing samples
+NAN_TOKEN = -2**31
+
+
+def gap_intervals(mask):
+    """
+    Runs of ``True`` in a boolean mask.
+    :rtype: NumPy :class:`~numpy.ndarray`
+    :return: ``(n, 2)`` int64 array of ``[start, end)`` sample indices
+    .. rubric:: Example
+    >>> gap_intervals(np.array([0, 1, 1, 0, 0, 1], dtype=bool))
+    array([[1, 3],
+           [5, 6]])
+    """
+    mask = np.asarray(mask, dtype=bool)
+    edges = np.flatnonzero(mask[1:] != mask[:-1]) + 1
+    if len(mask) and mask[0]:
+        edges = np.concatenate(([0], edges))
+    if len(mask) and mask[-1]:
+        edges = np.concatenate((edges, [len(mask)]))
+    return edges.astype(np.int64).reshape(-1, 2)
+
+
+def gap_mask(trace):
+    """
+    Boolean gap mask of a trace from ``trace.stats.gaps`` (all ``False`` if
+    there is none).
+    """
+    mask = np.zeros(trace.stats.npts, dtype=bool)
+    for start, end in trace.stats.get('gaps', []):
+        mask[start:end] = True
+    return mask
+
+
+def split_nan_tokens(stream, token=NAN_TOKEN):
+    """
+    Cut the traces of a stream at Winston NaN tokens.
+    Traces without tokens are kept as they are, the others are replaced by
+    their runs of valid samples, which are views of the original data.
+    :rtype: :class:`~obspy.core.stream.Stream`
+    """
+    st = Stream()
+    for tr in stream:
+        if not np.issubdtype(tr.data.dtype, np.integer):
+            st.append(tr)
+            continue
+        bad = tr.data == token
+        if not bad.any():
+            st.append(tr)
+            continue
+        for start, end in gap_intervals(~bad):
+            piece = Trace(data=tr.data[start:end], header=tr.stats.copy())
+            piece.stats.starttime = tr.stats.starttime + start * tr.stats.delta
+            st.append(piece)
+    return st
+
+
+def fill_gaps(trace, fill_value=0):
+    """
+    Record the masked samples of a trace in ``trace.stats.gaps`` and fill
+    them in place.
+    :type trace: :class:`~obspy.core.trace.Trace`
+    :param trace: Trace whose data may be a masked array, e.g. after
+        :meth:`~obspy.core.stream.Stream.merge` or
+        :meth:`~obspy.core.trace.Trace.trim` with ``fill_value=None``
+    :type fill_value: int, float or None
+    :param fill_value: Value written into the gaps. ``None`` keeps the
+        masked array.
+    :rtype: :class:`~obspy.core.trace.Trace`
+    """
+    mask = np.ma.getmask(trace.data)
+    if mask is np.ma.nomask:
+        trace.stats.gaps = np.empty((0, 2), dtype=np.int64)
+        trace.data = np.ma.getdata(trace.data)
+        return trace
+    trace.stats.gaps = gap_intervals(mask)
+    if fill_value is not None:
+        data = np.ma.getdata(trace.data)
+        data[mask] = fill_value
+        trace.data = data
+    return trace
@@ -0,0 +1,256 @@
+"""
+Stateful characteristic functions that are fed chunk by chunk.
+Each class keeps what it needs from the data seen so far, so that appending
+a chunk returns the characteristic function for just that chunk. The
+concatenated output matches a one-shot run of the corresponding function in
+:mod:`stalta_tuner.trigger` on the concatenated data.
+"""
+import numpy as np
+from scipy.signal import lfilter
+
+from stalta_tuner.trigger import z_detect
+
+
+class _History(object):
+    """
+    The last n samples of a series in a ring buffer. Samples before the
+    start of the series are zero.
+    """
+    def __init__(self, n):
+        self._buf = np.zeros(max(n, 1), dtype=np.float64)
+        self._pos = 0  # where the next sample goes
+
+    def lagged(self, a, lag):
+        """
+        Return ``a`` delayed by ``lag`` (<= n) samples, continuing the
+        series from the history. Costs O(len(a)).
+        """
+        head = min(len(a), lag)
+        idx = (self._pos - lag + np.arange(head)) % len(self._buf)
+        return np.concatenate((self._buf[idx], a[:len(a) - head]))
+
+    def push(self, a):
+        """
+        Append ``a`` to the series. Costs O(len(a)).
+        """
+        n = len(self._buf)
+        if len(a) >= n:
+            self._buf[:] = a[len(a) - n:]
+            self._pos = 0
+        else:
+            self._buf[(self._pos + np.arange(len(a))) % n] = a
+            self._pos = (self._pos + len(a)) % n
+
+
+class RecursiveSTALTA(object):
+    """
+    Recursive STA/LTA, fed chunk by chunk.
+    Output matches :func:`~stalta_tuner.trigger.recursive_sta_lta` run on
+    all data at once. Only the running STA and LTA are kept between chunks.
+    :type nsta: int
+    :param nsta: Length of short time average window in samples
+    :type nlta: int
+    :param nlta: Length of long time average window in samples
+    """
+    def __init__(self, nsta, nlta):
+        self.nsta = nsta
+        self.nlta = nlta
+        self.reset()
+
+    def reset(self):
+        """
+        Forget all data seen so far.
+        """
+        self._count = 0
+        self._sta = 0.
+        self._lta = 1e-99  # avoid zero division
+
+    def append(self, a):
+        """
+        Compute the characteristic function for the next chunk of data.
+        :type a: NumPy :class:`~numpy.ndarray`
+        :param a: Next samples of the seismic trace
+        :rtype: NumPy :class:`~numpy.ndarray`
+        :return: Characteristic function for the samples in ``a``
+        """
+        sq = np.square(np.asarray(a, dtype=np.float64))
+        charfct = np.zeros(len(sq), dtype=np.float64)
+        # like the C version, the very first sample is skipped
+        skip = 1 if self._count == 0 and len(sq) else 0
+        if len(sq) > skip:
+            csta = 1. / self.nsta
+            clta = 1. / self.nlta
+            # sta = csta * sq + icsta * sta as a first order IIR filter
+            sta, _ = lfilter([csta], [1., -(1 - csta)], sq[skip:],
+                             zi=[(1 - csta) * self._sta])
+            lta, _ = lfilter([clta], [1., -(1 - clta)], sq[skip:],
+                             zi=[(1 - clta) * self._lta])
+            np.divide(sta, lta, out=charfct[skip:])
+            self._sta = sta[-1]
+            self._lta = lta[-1]
+        charfct[:max(self.nlta - self._count, 0)] = 0.
+        self._count += len(sq)
+        return charfct
+
+
+class ClassicSTALTA(object):
+    """
+    Classic STA/LTA, fed chunk by chunk.
+    Output matches :func:`~stalta_tuner.trigger.classic_sta_lta` run on all
+    data at once, except that no error is raised while fewer than ``nlta``
+    samples were seen. The running STA and LTA sums and the last ``nlta``
+    squared samples are kept between chunks.
+    :type nsta: int
+    :param nsta: Length of short time average window in samples
+    :type nlta: int
+    :param nlta: Length of long time average window in samples
+    """
+    def __init__(self, nsta, nlta):
+        self.nsta = nsta
+        self.nlta = nlta
+        self.reset()
+
+    def reset(self):
+        """
+        Forget all data seen so far.
+        """
+        self._count = 0
+        self._sta = 0.
+        self._lta = 0.
+        self._history = _History(self.nlta)
+
+    def append(self, a):
+        """
+        Compute the characteristic function for the next chunk of data.
+        :type a: NumPy :class:`~numpy.ndarray`
+        :param a: Next samples of the seismic trace
+        :rtype: NumPy :class:`~numpy.ndarray`
+        :return: Characteristic function for the samples in ``a``
+        """
+        sq = np.square(np.asarray(a, dtype=np.float64))
+        # running sums, updated sample by sample with the squares entering
+        # and leaving the windows in the same order as the C version
+        sta = np.cumsum(np.concatenate((
+            [self._sta], sq - self._history.lagged(sq, self.nsta))))[1:]
+        lta = np.cumsum(np.concatenate((
+            [self._lta], sq - self._history.lagged(sq, self.nlta))))[1:]
+        self._history.push(sq)
+        charfct = sta / lta * (float(self.nlta) / float(self.nsta)) \
+            if len(sq) else sta
+        charfct[:max(self.nlta - 1 - self._count, 0)] = 0.
+        if len(sq):
+            self._sta = sta[-1]
+            self._lta = lta[-1]
+        self._count += len(sq)
+        return charfct
+
+
+class DelayedSTALTA(object):
+    """
+    Delayed STA/LTA, fed chunk by chunk.
+    The one-shot :func:`~stalta_tuner.trigger.delayed_sta_lta` wraps around
+    to the end of the trace for its first samples. As the end of the data is
+    not known yet, this class takes samples before the start as zero
+    instead, which matches the one-shot result for traces ending in at least
+    ``nsta + nlta + 1`` zeros. The running sums and the last
+    ``nsta + nlta + 1`` squared samples are kept between chunks.
+    :type nsta: int
+    :param nsta: Length of short time average window in samples
+    :type nlta: int
+    :param nlta: Length of long time average window in samples
+    """
+    def __init__(self, nsta, nlta):
+        self.nsta = nsta
+        self.nlta = nlta
+        self.reset()
+
+    def reset(self):
+        """
+        Forget all data seen so far.
+        """
+        self._count = 0
+        self._sta = 0.
+        self._lta = 0.
+        self._history = _History(self.nsta + self.nlta + 1)
+
+    def append(self, a):
+        """
+        Compute the characteristic function for the next chunk of data.
+        :type a: NumPy :class:`~numpy.ndarray`
+        :param a: Next samples of the seismic trace
+        :rtype: NumPy :class:`~numpy.ndarray`
+        :return: Characteristic function for the samples in ``a``
+        """
+        nsta, nlta = self.nsta, self.nlta
+        sq = np.square(np.asarray(a, dtype=np.float64))
+        lagged = self._history.lagged
+        sta = np.cumsum(np.concatenate((
+            [self._sta], (sq + lagged(sq, nsta)) / nsta)))[1:]
+        lta = np.cumsum(np.concatenate((
+            [self._lta], (lagged(sq, nsta + 1) +
+                          lagged(sq, nsta + nlta + 1)) / nlta)))[1:]
+        self._history.push(sq)
+        if len(sq):
+            self._sta = sta[-1]
+            self._lta = lta[-1]
+        mute = max(nlta + nsta + 50 - self._count, 0)
+        sta[:mute] = 0
+        lta[:mute] = 1  # avoid division by zero
+        self._count += len(sq)
+        return sta / lta
+
+
+class ZDetect(object):
+    """
+    Z-detector with a trailing reference window, fed chunk by chunk.
+    Output matches :func:`~stalta_tuner.trigger.z_detect` with the same
+    ``nsta`` and ``nlta`` run on all data at once. Only the last
+    ``nsta + nlta`` samples are kept between chunks.
+    :type nsta: int
+    :param nsta: Window length in Samples.
+    :type nlta: int
+    :param nlta: Length of trailing reference window for mean and standard
+        deviation in samples.
+    .. rubric:: Example
+    >>> import numpy as np
+    >>> from stalta_tuner.trigger import z_detect
+    >>> a = np.random.randn(5000)
+    >>> zd = ZDetect(50, 500)
+    >>> cft = np.concatenate([zd.append(c) for c in np.array_split(a, 7)])
+    >>> np.allclose(cft, z_detect(a, 50, 500))
+    True
+
+    Chunks may be shorter than ``nsta + nlta``:
+
+    >>> zd = ZDetect(100, 1000)
+    >>> cft = np.concatenate([zd.append(c) for c in np.array_split(a, 9)])
+    >>> np.allclose(cft, z_detect(a, 100, 1000))
+    True
+    """
+    def __init__(self, nsta, nlta):
+        self.nsta = nsta
+        self.nlta = nlta
+        self.reset()
+
+    def reset(self):
+        """
+        Forget all data seen so far.
+        """
+        self._tail = np.empty(0, dtype=np.float64)
+
+    def append(self, a):
+        """
+        Compute the characteristic function for the next chunk of data.
+        :type a: NumPy :class:`~numpy.ndarray`
+        :param a: Next samples of the seismic trace
+        :rtype: NumPy :class:`~numpy.ndarray`
+        :return: Characteristic function for the samples in ``a``
+        """
+        a = np.asarray(a, dtype=np.float64)
+        data = np.concatenate((self._tail, a))
+        # the first samples of data are either the whole history (still in
+        # warm-up, zeroed like in the one-shot version) or exactly the
+        # nsta + nlta samples needed to complete the running sums
+        cft = z_detect(data, self.nsta, self.nlta)[len(self._tail):]
+        self._tail = data[-(self.nsta + self.nlta):].copy()
+        return cft
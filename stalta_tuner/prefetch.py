@@ -0,0 +1,121 @@
+"""
+Background prefetch of the time windows next to the one being viewed.
+While the analyst looks at one window, the windows before and after it are
+fetched and preprocessed on background threads into a
+:class:`~stalta_tuner.cache.WaveformCache`, so that paging to them is served
+from memory.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+from obspy import UTCDateTime
+
+
+class Prefetcher(object):
+    """
+    Loads the windows around the current one into a cache in the background.
+    :type cache: :class:`~stalta_tuner.cache.WaveformCache`
+    :param cache: Cache the prefetched streams are put into.
+    :type n_windows: int
+    :param n_windows: Number of windows prefetched on each side.
+    :type max_in_flight: int
+    :param max_in_flight: Number of requests running at the same time.
+    :param loader: Function called like
+        :func:`~stalta_tuner.utils.get_stream`, which is the default.
+    .. rubric:: Example
+    >>> prefetcher = Prefetcher(cache, n_windows=2)  # doctest: +SKIP
+    >>> st = prefetcher.get_stream('IRIS', scnl, t1, t2, spec)  # doctest: +SKIP
+    >>> prefetcher.prefetch('IRIS', scnl, t1, t2 - t1, spec)  # doctest: +SKIP
+    """
+    def __init__(self, cache, n_windows=2, max_in_flight=2, loader=None):
+        self.cache = cache
+        self.n_windows = n_windows
+        self.loader = loader
+        self._pool = ThreadPoolExecutor(max_workers=max_in_flight)
+        self._lock = threading.RLock()  # done callbacks may run inside it
+        self._futures = {}  # cache key -> future
+        self._generation = 0
+
+    def _load(self, generation, key, args, kwargs):
+        # skip windows queued for a position the user already left
+        if generation == self._generation and key not in self.cache:
+            self.cache.get_stream(*args, loader=self.loader, **kwargs)
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._futures.get(key) is future:
+                del self._futures[key]
+
+    def cancel(self):
+        """
+        Cancel all prefetches that have not started yet. Running requests
+        are finished and still put into the cache.
+        :rtype: int
+        :return: Number of cancelled prefetches
+        """
+        with self._lock:
+            self._generation += 1
+            futures = list(self._futures.values())
+        # cancelled futures remove themselves through their done callback
+        return sum(future.cancel() for future in futures)
+
+    def prefetch(self, datasource, scnl, tstart, window, spec=None,
+                 **kwargs):
+        """
+        Queue the ``n_windows`` windows after and before ``tstart``, nearest
+        first and alternating forward and backward, after cancelling what
+        was queued for the previous position. Windows already cached or in
+        flight are skipped.
+        :type tstart: :class:`~obspy.core.utcdatetime.UTCDateTime`
+        :param tstart: Start of the current window
+        :type window: float
+        :param window: Window length in seconds
+        :param spec: Preprocessing, see :func:`~stalta_tuner.cache.preprocess`
+        :param kwargs: Further keyword arguments for the loader
+        :rtype: int
+        :return: Number of windows queued
+        """
+        self.cancel()
+        tstart = UTCDateTime(tstart)
+        queued = 0
+        with self._lock:
+            generation = self._generation
+            for k in range(1, self.n_windows + 1):
+                for t1 in (tstart + k * window, tstart - k * window):
+                    args = (datasource, scnl, t1, t1 + window, spec)
+                    key = self.cache.key(*args)
+                    if key in self._futures or key in self.cache:
+                        continue
+                    future = self._pool.submit(self._load, generation, key,
+                                               args, kwargs)
+                    self._futures[key] = future
+                    future.add_done_callback(
+                        lambda f, key=key: self._forget(key, f))
+                    queued += 1
+        return queued
+
+    def get_stream(self, datasource, scnl, tstart, tend, spec=None,
+                   **kwargs):
+        """
+        Fetch a stream through the cache like
+        :meth:`~stalta_tuner.cache.WaveformCache.get_stream`, but wait for a
+        prefetch of the same window that is already running instead of
+        requesting it a second time.
+        """
+        key = self.cache.key(datasource, scnl, tstart, tend, spec)
+        with self._lock:
+            future = self._futures.get(key)
+        if future is not None and not future.cancel():
+            try:
+                future.result()
+            except Exception:
+                pass  # fetch again below and let the error surface there
+        return self.cache.get_stream(datasource, scnl, tstart, tend, spec,
+                                     loader=self.loader, **kwargs)
+
+    def shutdown(self):
+        """
+        Cancel queued prefetches and stop the threads.
+        """
+        self.cancel()
+        self._pool.shutdown(wait=False)
@@ -0,0 +1,72 @@
+"""
+Resampling of traces to a common sampling rate.
+Rates in a small integer or rational ratio to the target (200, 250 or
+500 Hz to 100 Hz, say) are converted by polyphase FIR filtering, whose
+cost grows linearly with the trace length, instead of the FFT over the
+whole trace done by :meth:`~obspy.core.trace.Trace.resample`. The
+anti-alias filter of each ratio is designed once and cached.
+"""
+from fractions import Fraction
+from functools import lru_cache
+
+import numpy as np
+from scipy.signal import firwin, resample_poly
+
+
+def rational_ratio(rate, samprate, max_factor=64):
+    """
+    ``samprate / rate`` as a fraction ``(up, down)`` in lowest terms, or
+    ``None`` if the ratio is not exact with ``up`` and ``down`` up to
+    ``max_factor``.
+    >>> rational_ratio(250., 100.)
+    (2, 5)
+    >>> rational_ratio(40., 100.)
+    (5, 2)
+    >>> rational_ratio(99.97, 100.) is None
+    True
+    """
+    ratio = Fraction(samprate / rate).limit_denominator(max_factor)
+    if ratio.numerator > max_factor or \
+            float(ratio) * rate != samprate:
+        return None
+    return ratio.numerator, ratio.denominator
+
+
+@lru_cache(maxsize=None)
+def polyphase_filter(up, down, window=('kaiser', 5.0)):
+    """
+    Anti-alias FIR filter of :func:`scipy.signal.resample_poly` for a
+    ratio, designed once per ``(up, down, window)``.
+    """
+    max_rate = max(up, down)
+    h = firwin(2 * 10 * max_rate + 1, 1. / max_rate, window=window)
+    h.setflags(write=False)  # shared between calls
+    return h
+
+
+def resample_trace(tr, samprate, max_factor=64):
+    """
+    Resample a trace inplace.
+    Uses :func:`scipy.signal.resample_poly` with a cached filter if the
+    ratio of the rates is rational (see :func:`rational_ratio`) and falls
+    back to :meth:`~obspy.core.trace.Trace.resample` otherwise.
+    :type tr: :class:`~obspy.core.trace.Trace`
+    :param tr: Waveform data
+    :type samprate: float
+    :param samprate: New sampling rate
+    :type max_factor: int
+    :param max_factor: Largest up or down factor for the polyphase path
+    :rtype: :class:`~obspy.core.trace.Trace`
+    """
+    rate = tr.stats.sampling_rate
+    if rate == samprate:
+        return tr
+    ratio = rational_ratio(rate, samprate, max_factor)
+    if ratio is None or tr.stats.npts == 0:
+        return tr.resample(samprate)
+    up, down = ratio
+    data = np.require(tr.data, dtype=np.float64)
+    tr.data = resample_poly(data, up, down,
+                            window=np.array(polyphase_filter(up, down)))
+    tr.stats.sampling_rate = samprate
+    return tr
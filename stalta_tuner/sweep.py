@@ -0,0 +1,152 @@
+"""
+Batched STA/LTA parameter sweeps.
+Evaluates a whole grid of STA/LTA window lengths and trigger thresholds on a
+stream in one pass over the data, instead of one
+:func:`~stalta_tuner.trigger.coincidence_trigger` call per parameter set.
+"""
+import warnings
+
+import numpy as np
+
+from stalta_tuner.trigger import (TRIGGER_DTYPE, TRIGGER_FUNCTIONS,
+                                  coincidence_events, trigger_array,
+                                  trigger_onset)
+
+
+def classic_sta_lta_energy(energy, nsta, nlta, out=None, work=None):
+    """
+    Classic STA/LTA from a precomputed energy prefix sum.
+    Gives the same result as :func:`~stalta_tuner.trigger.classic_sta_lta`
+    for ``energy = np.cumsum(a ** 2)``, so one prefix sum serves any number of
+    window lengths.
+    :type energy: NumPy :class:`~numpy.ndarray`
+    :param energy: Cumulative sum of the squared seismic trace
+    :type nsta: int
+    :param nsta: Length of short time average window in samples
+    :type nlta: int
+    :param nlta: Length of long time average window in samples
+    :type out: NumPy :class:`~numpy.ndarray`, dtype=float64, optional
+    :param out: Output array of ``len(energy)``, allocated if not given.
+    :type work: NumPy :class:`~numpy.ndarray`, dtype=float64, optional
+    :param work: Scratch array of ``len(energy)`` for the LTA, allocated if
+        not given.
+    :rtype: NumPy :class:`~numpy.ndarray`
+    :return: Characteristic function of classic STA/LTA
+    """
+    m = len(energy)
+    if out is None:
+        out = np.empty(m, dtype=np.float64)
+    if work is None:
+        work = np.empty(m, dtype=np.float64)
+    sta, lta = out, work
+    for avg, n in ((sta, nsta), (lta, nlta)):
+        avg[:n] = energy[:n]
+        np.subtract(energy[n:], energy[:m - n], out=avg[n:])
+        avg /= n
+    # Pad zeros
+    sta[:nlta - 1] = 0
+    # Avoid division by zero by setting zero values to tiny float
+    dtiny = np.finfo(0.0).tiny
+    np.maximum(lta, dtiny, out=lta)
+    sta /= lta
+    return sta
+
+
+def sta_lta_sweep(stream, sta, lta, thresholds, thr_coincidence_sum,
+                  trigger_type='classicstalta', trace_ids=None,
+                  max_trigger_length=1e6, delete_long_trigger=False,
+                  trigger_off_extension=0, **options):
+    """
+    Count single station and coincidence triggers for a grid of parameters.
+    Every combination of ``sta``, ``lta`` and threshold pair is evaluated like
+    a call to :func:`~stalta_tuner.trigger.coincidence_trigger`. For
+    ``'classicstalta'`` the energy prefix sum of each channel is computed
+    once and reused for all window lengths; other trigger types are computed
+    once per window pair with the routine from
+    :data:`~stalta_tuner.trigger.TRIGGER_FUNCTIONS`. Channels are processed
+    one at a time, so besides the single station trigger lists only one
+    prefix sum and two CFT buffers are held in memory, however large the
+    grid. The stream is not modified.
+    :type stream: :class:`~obspy.core.stream.Stream`
+    :param stream: Waveform data for all stations.
+    :type sta: list of float
+    :param sta: Short time average window lengths in seconds
+    :type lta: list of float
+    :param lta: Long time average window lengths in seconds
+    :type thresholds: list of (float, float)
+    :param thresholds: ``(thr_on, thr_off)`` pairs
+    :type thr_coincidence_sum: int or float
+    :param thr_coincidence_sum: Threshold for coincidence sum.
+    :type trigger_type: str
+    :param trigger_type: Trigger type, e.g. ``'classicstalta'`` or
+        ``'recstalta'``
+    :param options: Further keyword arguments for the trigger routine (e.g.
+        ``ratio`` and ``quiet`` for ``'carlstatrig'``).
+    See :func:`~stalta_tuner.trigger.coincidence_trigger` for the remaining
+    parameters.
+    :rtype: tuple of two NumPy :class:`~numpy.ndarray`
+    :return: Number of single station triggers (summed over all channels)
+        and number of coincidence triggers, both of shape
+        ``(len(sta), len(lta), len(thresholds))``. Window pairs with
+        ``sta >= lta`` are set to -1.
+    """
+    trigger_type = trigger_type.lower()
+    sta = np.atleast_1d(np.asarray(sta, dtype=np.float64))
+    lta = np.atleast_1d(np.asarray(lta, dtype=np.float64))
+    thresholds = np.atleast_2d(np.asarray(thresholds, dtype=np.float64))
+    shape = (len(sta), len(lta), len(thresholds))
+    invalid = sta[:, None] >= lta[None, :]
+    if trace_ids is None:
+        trace_ids = [tr.id for tr in stream]
+    if isinstance(trace_ids, list) or isinstance(trace_ids, tuple):
+        trace_ids = dict.fromkeys(trace_ids, 1)
+    channels = dict((tr_id, k) for k, tr_id in enumerate(trace_ids))
+
+    trigger_counts = np.zeros(shape, dtype=np.int64)
+    # single station triggers of each grid point for the coincidence sum
+    triggers = dict((index, []) for index in np.ndindex(shape))
+    kwargs = {'max_len_delete': delete_long_trigger}
+    for tr in stream:
+        if tr.id not in trace_ids:
+            msg = "At least one trace's ID was not found in the " + \
+                  "trace ID list and was disregarded (%s)" % tr.id
+            warnings.warn(msg, UserWarning)
+            continue
+        spr = tr.stats.sampling_rate
+        kwargs['max_len'] = int(max_trigger_length * spr + 0.5)
+        data = np.ascontiguousarray(tr.data, dtype=np.float64)
+        if trigger_type == 'classicstalta':
+            # the energy prefix sum, shared by all window lengths
+            energy = np.cumsum(np.square(data))
+            cft = np.empty(len(data), dtype=np.float64)
+            work = np.empty(len(data), dtype=np.float64)
+        for i, j in np.ndindex(shape[:2]):
+            nsta = int(sta[i] * spr)
+            nlta = int(lta[j] * spr)
+            if invalid[i, j] or nlta > len(data):
+                continue
+            if trigger_type == 'classicstalta':
+                classic_sta_lta_energy(energy, nsta, nlta, out=cft, work=work)
+            else:
+                cft = TRIGGER_FUNCTIONS[trigger_type](data, nsta, nlta,
+                                                      **options)
+            # all threshold pairs in one call; no triggers in gaps or while
+            # the LTA recovers from them
+            onsets = trigger_onset(cft, thresholds[:, 0], thresholds[:, 1],
+                                   gaps=tr.stats.get('gaps'), holdoff=nlta,
+                                   **kwargs)
+            for k, tmp_triggers in enumerate(onsets):
+                trigger_counts[i, j, k] += len(tmp_triggers)
+                triggers[(i, j, k)].append(
+                    trigger_array(tmp_triggers, tr, channels[tr.id]))
+
+    coincidence_counts = np.zeros(shape, dtype=np.int64)
+    for index, tmp_triggers in triggers.items():
+        tmp_triggers = np.concatenate(
+            tmp_triggers or [np.empty(0, dtype=TRIGGER_DTYPE)])
+        coincidence_counts[index] = len(coincidence_events(
+            tmp_triggers, trace_ids, thr_coincidence_sum,
+            trigger_off_extension=trigger_off_extension))
+    trigger_counts[invalid] = -1
+    coincidence_counts[invalid] = -1
+    return trigger_counts, coincidence_counts
@@ -1,5 +1,6 @@
 def get_stream(datasource, scnl, tstart, tend, fill_value=0, filepattern='*',
-    filter=None, samprate=100, verbose=False):
+    filter=None, samprate=100, verbose=False, index_path=None, n_workers=None, timeout=None,
+    client=None, pool=None, archive=None):
     """
     Generalized (and more robust) way to retrieve waveform data through ObsPy
     Download data from files in a folder, from IRIS, or a Earthworm waveserver
@@ -18,6 +19,43 @@ def get_stream(datasource, scnl, tstart, tend, fill_value=0, filepattern='*',
     samprate=100
      Resamples all waveforms to the same sample rate.
     
+    index_path=None
+     SQLite header index of the files in the directory (see find_files). None keeps it
+     in the directory itself (or in ~/.stalta_tuner if that is read-only), False reads
+     the headers of all files on every call like before.
+    
+    n_workers=None
+     Concurrent retrieval from a server. None requests one channel after the other. Otherwise
+     FDSN servers get a single bulk request for all channels, and Earthworm waveservers (or
+     FDSN, if the bulk request fails) up to n_workers requests at the same time. The stream
+     keeps the order of scnl and the empty traces for channels without data either way.
+    
+    timeout=None
+     Timeout in seconds of every request to the server (the client's default if None). A
+     request that times out is tried once more and then treated as having no data.
+    
+    client=None
+     Client to use instead of the one made from datasource, e.g. one kept between calls or a
+     stand-in for a waveserver; anything with get_waveforms (and optionally
+     get_waveforms_bulk) like the ObsPy clients.
+    
+    pool=None
+     ClientPool the client is taken from (stalta_tuner.clients). None uses the pool shared by
+     the whole process, so the client (and for FDSN its service discovery) is reused across
+     calls; False creates a new client like before. A client whose requests all failed with
+     connection errors or timeouts is dropped from the pool.
+    
+    archive=None
+     Local channel-day archive (stalta_tuner.archive.Archive, or the path of its directory)
+     for server data. Channels whose whole period was fetched before are read from its
+     memory-mapped files instead of the server, without decoding; everything else that is
+     fetched is added to it (resampled, before tapering). The Stream returned is writable
+     and tapered in place, so archived windows are still copied once per fetch.
+    
+    Gaps, NaN tokens and the padding up to tstart and tend are filled with fill_value, and
+    their sample ranges are kept in tr.stats.gaps (see stalta_tuner.gaps) so that triggers in
+    or right after them can be dropped (trigger_onset, coincidence_trigger).
+    
     Returns ObsPy stream objects
     
     Based on code by Alicia Hotovec-Ellis and Aaron Wech.
@@ -39,6 +77,8 @@ def get_stream(datasource, scnl, tstart, tend, fill_value=0, filepattern='*',
     from scipy import stats
     from scipy.fftpack import fft
     import glob, os, itertools
+    from stalta_tuner.resampling import resample_trace
+    from stalta_tuner.gaps import fill_gaps, split_nan_tokens
     
     #print(datasource)
     #print(scnl)
@@ -61,23 +101,10 @@ def get_stream(datasource, scnl, tstart, tend, fill_value=0, filepattern='*',
     if '/' in datasource:
         # Retrieve data from file structure
     
-        flist = list(itertools.chain.from_iterable(glob.iglob(os.path.join(
-            root, filepattern)) for root, dirs, files in os.walk(datasource)))
-                
         # Determine which subset of files to load based on start and end times and
         # station name; we'll fully deal with stations below
-        flist_sub = []
-        for f in flist:
-            # Load header only
-            stmp = obspy.read(f, headonly=True)
-            # Check if station is contained in the stas list
-            if stmp[0].stats.station in stas:
-                # Check if contains either start or end time
-                ststart = stmp[0].stats.starttime
-                stend = stmp[0].stats.endtime
-                if (ststart<=tstart and tstart<=stend) or (ststart<=tend and
-                    tend<=stend) or (tstart<=stend and ststart<=tend):
-                    flist_sub.append(f)
+        flist_sub = find_files(datasource, stas, tstart, tend, filepattern=filepattern,
+                               index_path=index_path, nets=nets, chas=chas, locs=locs)
         
         # Fully load data from file
         stmp = Stream()
@@ -90,8 +117,8 @@ def get_stream(datasource, scnl, tstart, tend, fill_value=0, filepattern='*',
         stmp = stmp.taper(max_percentage=0.01)
         for m in range(len(stmp)):
             if stmp[m].stats.sampling_rate != samprate:
-                stmp[m] = stmp[m].resample(samprate)
-        stmp = stmp.merge(method=1, fill_value=fill_value)
+                stmp[m] = resample_trace(stmp[m], samprate) # polyphase for rational ratios, FFT otherwise
+        stmp = stmp.merge(method=1, fill_value=None) # gaps stay masked until the end
         
         # Only grab stations/channels that we want and in order
         netlist = []
@@ -119,58 +146,217 @@ def get_stream(datasource, scnl, tstart, tend, fill_value=0, filepattern='*',
     
     else:
         # retrieve data from server
-     
-        if '.' not in datasource:
-            client = Client(datasource)
-        else:
-            datasource = datasource.split(':')
-            client = EWClient(datasource[0], int(datasource[1]))
+        from obspy.clients.fdsn.header import FDSNException
+        from concurrent.futures import ThreadPoolExecutor
+        from stalta_tuner.clients import CLIENT_POOL, make_client
+        from stalta_tuner.archive import Archive
         
-        for n in range(len(stas)):
-            try:
-                stmp = client.get_waveforms(nets[n], stas[n], locs[n], chas[n], tstart, tend)
-                for m in range(len(stmp)):
-                    #stmp[m].data = np.ma.masked_where(stmp[m].data == -2**31, stmp[m].data) # masks out all values of -2**31 (Winston NaN Token)
-                    #stmp[m] = stmp[m].split().merge(method=0, fill_value='interpolate')[0] # splits trace at masked values; then re-merges using linear interpolation
-                    stmp[m].data = np.where(stmp[m].data==-2**31,0,stmp[m].data)
-                    if stmp[m].stats.sampling_rate != samprate:
-                        stmp[m] = stmp[m].resample(samprate)
-                stmp = stmp.taper(max_percentage=0.01)
-                stmp = stmp.merge(method=1, fill_value=fill_value)
-            except (obspy.clients.fdsn.header.FDSNException):
-                try: # try again
-                    stmp = client.get_waveforms(nets[n], stas[n], locs[n], chas[n],
-                            tstart, tend)
-                    for m in range(len(stmp)):
-                        #stmp[m].data = np.ma.masked_where(stmp[m].data == -2**31, stmp[m].data) # masks out all values of -2**31 (Winston NaN Token)
-                        #stmp[m] = stmp[m].split().merge(method=0, fill_value='interpolate')[0] # splits trace at masked values; then re-merges using linear interpolation
-                        stmp[m].data = np.where(stmp[m].data==-2**31,0,stmp[m].data)
-                        if stmp[m].stats.sampling_rate != samprate:
-                            stmp[m] = stmp[m].resample(samprate)
-                    stmp = stmp.taper(max_percentage=0.01)
-                    stmp = stmp.merge(method=1, fill_value=fill_value)
-                except (obspy.clients.fdsn.header.FDSNException):
-                    print('No data found for {0}.{1}'.format(stas[n],nets[n]))
-                    trtmp = Trace()
-                    trtmp.stats.sampling_rate = samprate
-                    trtmp.stats.station = stas[n]
-                    stmp = Stream().extend([trtmp.copy()])
-                                            
+        # channels whose whole period is in the local archive are not requested again
+        if archive is not None and not isinstance(archive, Archive):
+            archive = Archive(archive)
+        archived = {}
+        if archive is not None:
+            for n in range(len(stas)):
+                stmp = archive.read(scnl[n], tstart, tend, samprate)
+                if stmp is not None:
+                    archived[n] = stmp
+        
+        pooled = client is None and pool is not False and len(archived) < len(stas)
+        if pooled:
+            pool = CLIENT_POOL if pool is None else pool
+            client = pool.get(datasource, timeout) # kept between calls
+        elif client is None and len(archived) < len(stas):
+            client = make_client(datasource, timeout)
+        failures = [] # channels whose requests failed with a connection error or timeout
+        
+        def empty_stream(n):
+            trtmp = Trace()
+            trtmp.stats.sampling_rate = samprate
+            trtmp.stats.station = stas[n]
+            return Stream().extend([trtmp.copy()])
+        
+        def fetch(n):
+            if n in archived:
+                return archived[n]
+            # timeouts and refused connections are treated like an FDSN error: try again once
+            for attempt in range(2):
+                try:
+                    return client.get_waveforms(nets[n], stas[n], locs[n], chas[n], tstart, tend)
+                except (FDSNException, OSError) as err:
+                    error = err
+            if isinstance(error, OSError):
+                failures.append(n)
+            print('No data found for {0}.{1}'.format(stas[n],nets[n]))
+            return None
+        
+        def clean(n, stmp):
+            if stmp is None:
+                return empty_stream(n)
+            stmp = split_nan_tokens(stmp) # Winston NaN tokens (-2**31) become gaps, without copying the data
+            for m in range(len(stmp)):
+                if stmp[m].stats.sampling_rate != samprate:
+                    stmp[m] = resample_trace(stmp[m], samprate) # polyphase for rational ratios, FFT otherwise
+                stmp[m].data = np.require(stmp[m].data, requirements='W') # one copy of archived (read-only) data, for the taper
+            if archive is not None and n not in archived:
+                archive.write(scnl[n], stmp, tstart, tend, samprate) # before tapering
+            stmp = stmp.taper(max_percentage=0.01)
+            stmp = stmp.merge(method=1, fill_value=None) # gaps stay masked until the end
             # Last check for length; catches problem with empty waveserver
             if len(stmp) != 1:
                 print('No data found for {}.{}.{}.{}'.format(stas[n],chas[n],nets[n],locs[n]))
-                trtmp = Trace()
-                trtmp.stats.sampling_rate = samprate
-                trtmp.stats.station = stas[n]
-                stmp = Stream().extend([trtmp.copy()])
-                
-            st.extend(stmp.copy()) 
+                stmp = empty_stream(n)
+            return stmp
+        
+        if not n_workers:
+            # one station after the other
+            for n in range(len(stas)):
+                st.extend(clean(n, fetch(n)).copy())
+        
+        else:
+            bulk = None
+            if hasattr(client, 'get_waveforms_bulk') and len(archived) < len(stas):
+                # FDSN: all channels in one request, split up again below
+                for attempt in range(2):
+                    try:
+                        bulk = client.get_waveforms_bulk([(nets[n], stas[n], locs[n], chas[n], tstart, tend)
+                                                          for n in range(len(stas)) if n not in archived])
+                        break
+                    except (FDSNException, OSError):
+                        pass
+            
+            def fetch_and_clean(n):
+                if bulk is None or n in archived:
+                    stmp = fetch(n)
+                else:
+                    stmp = bulk.select(network=nets[n], station=stas[n], location=locs[n].replace('--', ''),
+                                       channel=chas[n]).copy()
+                return clean(n, stmp)
+            
+            # Earthworm (or a failed bulk request): a bounded pool of single requests; map keeps the scnl order
+            with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                for stmp in executor.map(fetch_and_clean, range(len(stas))):
+                    st.extend(stmp)
+        
+        if pooled and stas and len(failures) == len(stas):
+            # nothing came through: do not hand this client out again
+            pool.discard(datasource, timeout)
 
 
-    st = st.trim(starttime=tstart, endtime=tend, pad=True, fill_value=fill_value)
+    # gaps (and padding) are filled in place and kept in tr.stats.gaps, see stalta_tuner.gaps
+    st = st.trim(starttime=tstart, endtime=tend, pad=True, fill_value=None)
+    for tr in st:
+        fill_gaps(tr, fill_value)
     
     return st
     
+def stream_chunks(datasource, scnl, tstart, tend, chunk_length, overlap=0, prefetch=1,
+    loader=None, **kwargs):
+    """
+    Reads a long period in chunks, one Stream at a time.
+    
+    Yields the Streams of the windows [tstart, tstart+chunk_length],
+    [tstart+chunk_length-overlap, tstart+2*chunk_length-overlap], ... up to tend (the last
+    one is shorter if needed). Every chunk is fetched like get_stream does (the same
+    SCNL parsing, order and fill_value handling; further keyword arguments are passed on),
+    so all traces of a chunk start and end at the same time.
+    
+    prefetch=1
+     Number of chunks fetched in the background while the caller works on the current one.
+     No more than prefetch+2 chunks are held at any time (the next fetch starts when the
+     caller asks for the next chunk, while it still holds the previous one), so memory does
+     not grow with the length of the period.
+    
+    loader=None
+     Function called like get_stream for each chunk, get_stream by default.
+    
+    Example:
+    >>> for st in stream_chunks('IRIS', ['HSR.EHZ.UW.--'], '2004-09-28', '2004-10-28', 3600, overlap=60):
+    ...     process(st)
+    """
+    from obspy import UTCDateTime
+    from concurrent.futures import ThreadPoolExecutor
+    from collections import deque
+    
+    tstart = UTCDateTime(tstart)
+    tend = UTCDateTime(tend)
+    if overlap >= chunk_length:
+        raise ValueError('overlap must be shorter than chunk_length')
+    loader = get_stream if loader is None else loader
+    
+    def windows():
+        t1 = tstart
+        while True:
+            t2 = min(t1 + chunk_length, tend)
+            yield t1, t2
+            if t2 >= tend:
+                return
+            t1 = t1 + chunk_length - overlap
+    
+    pending = deque() # futures of the chunks fetched ahead, in order
+    executor = ThreadPoolExecutor(max_workers=max(prefetch, 1))
+    try:
+        for t1, t2 in windows():
+            pending.append(executor.submit(loader, datasource, scnl, t1, t2, **kwargs))
+            if len(pending) > prefetch:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # the caller stopped early or an error came up: drop what was fetched ahead
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+    
+def find_files(datasource, stas, tstart, tend, filepattern='*', index_path=None,
+               nets=None, chas=None, locs=None):
+    """
+    Lists the waveform files below a directory with data of the given stations between
+    tstart and tend. nets, chas and locs narrow this down to the networks, channels and
+    locations of the SCNLs ('--' for an empty location), any if None.
+    
+    The headers are looked up in a persistent index (stalta_tuner.fileindex.HeaderIndex),
+    which is updated first: only files that are new or whose modification time or size
+    changed are read again, and deleted files are dropped. index_path=None keeps the index
+    in the directory (or in ~/.stalta_tuner if that is read-only); index_path=False reads
+    every header instead.
+    """
+    import obspy
+    import glob, os, itertools
+    from stalta_tuner.fileindex import INDEX_NAME, HeaderIndex, default_index_path
+    
+    if locs is not None:
+        locs = [loc.replace('--', '') for loc in locs] # as in the headers
+    
+    flist = list(itertools.chain.from_iterable(glob.iglob(os.path.join(
+        root, filepattern)) for root, dirs, files in os.walk(datasource)))
+    flist = [f for f in flist if os.path.isfile(f)]
+    
+    if index_path is False:
+        flist_sub = []
+        for f in flist:
+            # Load header only
+            stmp = obspy.read(f, headonly=True)
+            # Check if station is contained in the stas list
+            if stmp[0].stats.station in stas and (nets is None or stmp[0].stats.network in nets) \
+                and (chas is None or stmp[0].stats.channel in chas) \
+                and (locs is None or stmp[0].stats.location in locs):
+                # Check if contains either start or end time
+                ststart = stmp[0].stats.starttime
+                stend = stmp[0].stats.endtime
+                if (ststart<=tstart and tstart<=stend) or (ststart<=tend and
+                    tend<=stend) or (tstart<=stend and ststart<=tend):
+                    flist_sub.append(f)
+        return flist_sub
+    
+    if index_path is None:
+        index_path = default_index_path(datasource)
+    # the index (and its journal) may live in the directory it indexes
+    flist = [f for f in flist if not os.path.basename(f).startswith(INDEX_NAME)
+             and os.path.abspath(f) != os.path.abspath(index_path)]
+    index = HeaderIndex(index_path)
+    index.update(flist, prune=datasource)
+    return index.query(stas, tstart, tend, networks=nets, channels=chas, locations=locs)
+
 def grab_data(server, port, scnl, T1, T2, fill_value=0):
     from obspy import Stream
     from obspy.clients.earthworm import Client
@@ -205,7 +391,7 @@ def grab_data(server, port, scnl, T1, T2, fill_value=0):
     print(st)
     return st
     
-def grab_file_data(filepath, scnl, tstart, tend, fill_value=0):
+def grab_file_data(filepath, scnl, tstart, tend, fill_value=0, index_path=None):
     import obspy
     from obspy import Stream, Trace
     import glob, os, itertools
@@ -227,24 +413,11 @@ def grab_file_data(filepath, scnl, tstart, tend, fill_value=0):
     
         # Generate list of files
         #if opt.server == 'file':
-        flist = list(itertools.chain.from_iterable(glob.iglob(os.path.join(
-        	root,"*")) for root, dirs, files in os.walk(filepath)))
         # "*" takes the place of wildcard lists, see REDPy documentation
-                
         # Determine which subset of files to load based on start and end times and
         # station name; we'll fully deal with stations below
-        flist_sub = []
-        for f in flist:
-            # Load header only
-            stmp = obspy.read(f, headonly=True)
-            # Check if station is contained in the stas list
-            if stmp[0].stats.station in stas:
-                # Check if contains either start or end time
-                ststart = stmp[0].stats.starttime
-                stend = stmp[0].stats.endtime
-                if (ststart<=tstart and tstart<=stend) or (ststart<=tend and
-                    tend<=stend) or (tstart<=stend and ststart<=tend):
-                    flist_sub.append(f)
+        flist_sub = find_files(filepath, stas, tstart, tend, filepattern="*",
+                               index_path=index_path, nets=nets, chas=chas) # locs are always '' here
         
         # Fully load data from file
         stmp = Stream()
@@ -323,12 +496,14 @@ def orgtrigsbychan(channels, triggers):
         ctrigs.append({'station':chan, 'times':ctimes})
     return ctrigs
 
-'''Converts list of trigger dictionaries to array of trigger times'''
+'''Converts list of trigger dictionaries to array of trigger times (float64 ms since epoch, as on a Bokeh datetime axis)'''
 def trigtimes(triggers):
     import numpy as np
-    from matplotlib.dates import num2date
-    triggert = []
-    for t in triggers:
-        #print(type(t['time']))
-        triggert.append(num2date(t['time'].matplotlib_date))
-    return np.array(triggert)
\ No newline at end of file
+    return np.array([t['time'].timestamp*1000. for t in triggers], dtype=np.float64)
+
+'''Times of the samples of a trace (or of the samples at index idx) as float64 ms since epoch, as on a Bokeh datetime axis'''
+def times_ms(tr, idx=None):
+    import numpy as np
+    if idx is None:
+        idx = np.arange(tr.stats.npts)
+    return tr.stats.starttime.timestamp*1000. + np.asarray(idx, dtype=np.float64)*(tr.stats.delta*1000.)